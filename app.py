@@ -1,6 +1,8 @@
 # app.py
 import os
 import logging
+import threading
+import click
 from flask import Flask
 from flask_login import LoginManager
 from werkzeug.middleware.proxy_fix import ProxyFix
@@ -20,21 +22,101 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
-# Supabase client ONLY
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+# Storage: Supabase (default) or an embedded SQLite database for single-node installs.
+# Both are used through the same Supabase query-builder interface.
+app.config['STORAGE_BACKEND'] = os.environ.get("STORAGE_BACKEND", "supabase")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    logger.error("❌ Missing Supabase credentials!")
-    raise ValueError("SUPABASE_URL and SUPABASE_KEY required")
-
-try:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+if app.config['STORAGE_BACKEND'] == "sqlite":
+    from sqlite_store import SQLiteClient
+    supabase = SQLiteClient(os.environ.get("SQLITE_PATH", "lessonplan.sqlite3"))
     app.config["SUPABASE_CLIENT"] = supabase
-    logger.info("✅ Supabase initialized")
-except Exception as e:
-    logger.error(f"❌ Supabase error: {e}")
-    raise
+    logger.info("✅ SQLite storage initialized")
+else:
+    SUPABASE_URL = os.environ.get("SUPABASE_URL")
+    SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        logger.error("❌ Missing Supabase credentials!")
+        raise ValueError("SUPABASE_URL and SUPABASE_KEY required")
+
+    try:
+        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        app.config["SUPABASE_CLIENT"] = supabase
+        logger.info("✅ Supabase initialized")
+    except Exception as e:
+        logger.error(f"❌ Supabase error: {e}")
+        raise
+
+# Token ledger: one atomic round trip per balance change (sql/apply_ledger_change.sql)
+from ledger import SupabaseLedger, MemoryLedger, stress
+# (MemoryLedger has no users table behind it; it is only for `flask bench-ledger` and tests.)
+app.config["LEDGER"] = SupabaseLedger(supabase)
+
+# Write-behind buffer for token_transactions rows logged outside the ledger RPC
+app.config['TXN_BUFFER_FLUSH_MS'] = int(os.environ.get("TXN_BUFFER_FLUSH_MS", 500))
+app.config['TXN_BUFFER_BATCH_SIZE'] = int(os.environ.get("TXN_BUFFER_BATCH_SIZE", 200))
+app.config['TXN_BUFFER_MAX_ROWS'] = int(os.environ.get("TXN_BUFFER_MAX_ROWS", 10000))
+app.config['TXN_BUFFER_SPILL_PATH'] = os.environ.get("TXN_BUFFER_SPILL_PATH", "token_transactions.spill.jsonl")
+app.config['TXN_BUFFER_REPLAY_INTERVAL'] = float(os.environ.get("TXN_BUFFER_REPLAY_INTERVAL", 5))
+
+from txn_buffer import transaction_buffer
+transaction_buffer.init_app(app)
+
+# Background job pool for lesson generation
+app.config['JOB_WORKERS'] = int(os.environ.get("JOB_WORKERS", 4))
+app.config['JOB_MAX_PENDING'] = int(os.environ.get("JOB_MAX_PENDING", 100))
+# Job state is also kept in the jobs table (sql/jobs.sql) so any worker can answer polls and streams
+app.config['JOB_SAVE_INTERVAL'] = float(os.environ.get("JOB_SAVE_INTERVAL", 1))
+app.config['JOB_POLL_INTERVAL'] = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+app.config['LESSON_STREAM_SAVE_INTERVAL'] = float(os.environ.get("LESSON_STREAM_SAVE_INTERVAL", 5))
+# Seconds to wait for the LLM's first chunk before a new lesson gets a fast draft instead; 0 waits indefinitely
+app.config['LESSON_DRAFT_AFTER'] = float(os.environ.get("LESSON_DRAFT_AFTER", 20))
+app.config['BATCH_MAX_TOPICS'] = int(os.environ.get("BATCH_MAX_TOPICS", 60))
+app.config['BATCH_MAX_CONCURRENCY'] = int(os.environ.get("BATCH_MAX_CONCURRENCY", 8))
+
+from jobs import job_queue
+job_queue.init_app(app)
+
+# Near-duplicate topic index, filled in the background so startup isn't delayed
+app.config['TOPIC_SIMILARITY_THRESHOLD'] = float(os.environ.get("TOPIC_SIMILARITY_THRESHOLD", 0.85))
+
+def load_topic_index():
+    from topic_index import topic_index
+    try:
+        topic_index.load(supabase)
+    except Exception as e:
+        logger.error(f"❌ Topic index load failed: {e}")
+
+threading.Thread(target=load_topic_index, name='topic-index-load', daemon=True).start()
+
+# Full-text lesson search; kept up to date on every write, so only an empty index is backfilled
+def load_search_index():
+    from lesson_search import lesson_search
+    try:
+        if not lesson_search.count():
+            lesson_search.load(supabase)
+    except Exception as e:
+        logger.error(f"❌ Search index load failed: {e}")
+
+threading.Thread(target=load_search_index, name='search-index-load', daemon=True).start()
+
+app.config['LESSON_PAGE_SIZE'] = int(os.environ.get("LESSON_PAGE_SIZE", 24))
+app.config['ADMIN_USERS_PAGE_SIZE'] = int(os.environ.get("ADMIN_USERS_PAGE_SIZE", 50))
+app.config['ADMIN_EXPORT_CHUNK_SIZE'] = int(os.environ.get("ADMIN_EXPORT_CHUNK_SIZE", 1000))
+app.config['ADMIN_BULK_CHUNK_SIZE'] = int(os.environ.get("ADMIN_BULK_CHUNK_SIZE", 200))
+app.config['ADMIN_BULK_MAX_USERS'] = int(os.environ.get("ADMIN_BULK_MAX_USERS", 5000))
+
+# Response compression (brotli when installed, else gzip)
+app.config['COMPRESS_ENABLED'] = os.environ.get("COMPRESS_ENABLED", "1") not in ("0", "false", "False")
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get("COMPRESS_MIN_SIZE", 500))
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+app.config['COMPRESS_BROTLI_LEVEL'] = int(os.environ.get("COMPRESS_BROTLI_LEVEL", 4))
+
+from compression import compress
+compress.init_app(app)
+
+# Bearer token for scraping /metrics; without it only admins can read the endpoint
+app.config['METRICS_TOKEN'] = os.environ.get("METRICS_TOKEN")
 
 # Login manager
 login_manager = LoginManager()
@@ -70,6 +152,86 @@ def handle_not_found(e):
     if request.path.startswith('/api/'):
         return jsonify({'success': False, 'message': 'Not found'}), 404
     return e
+@app.cli.command('warm-cache')
+@click.option('--rate', default=10, show_default=True, help='Maximum LLM calls per minute.')
+@click.option('--max-items', type=int, default=None, help='Stop after this many generations.')
+@click.option('--max-minutes', type=float, default=None, help='Stop after this many minutes (end of quiet hours).')
+@click.option('--popular-only', is_flag=True, help='Skip the grade/strategy catalogue.')
+def warm_cache_command(rate, max_items, max_minutes, popular_only):
+    """Pre-generate popular lesson plans into the generation cache."""
+    from cache_warmer import warm_cache
+
+    def report(summary):
+        click.echo(f"generated={summary['generated']} failed={summary['failed']} "
+                   f"skipped={summary['skipped']} / {summary['candidates']} candidates")
+
+    summary = warm_cache(supabase, rate_per_minute=rate, max_items=max_items,
+                         max_minutes=max_minutes, include_catalogue=not popular_only,
+                         progress=report)
+    click.echo(f"Done: {summary}")
+
+app.config['RENEWAL_INLINE'] = os.environ.get("RENEWAL_INLINE", "1") not in ("0", "false", "False")
+
+@app.cli.command('renew-tokens')
+@click.option('--chunk-size', default=500, show_default=True, help='Users fetched and updated per batch.')
+@click.option('--dry-run', is_flag=True, help='Only count the users that are due.')
+def renew_tokens_command(chunk_size, dry_run):
+    """Renew monthly token balances for every user that is due (run on the 1st)."""
+    from renewal import renew_due_users
+    summary = renew_due_users(supabase, app.config["LEDGER"], chunk_size=chunk_size, dry_run=dry_run)
+    click.echo(f"Done: {summary}")
+
+app.config['PURGE_CHUNK_SIZE'] = int(os.environ.get("PURGE_CHUNK_SIZE", 200))
+
+@app.cli.command('purge-deleted')
+def purge_deleted_command():
+    """Remove accounts and lessons still marked deleted (e.g. after a restart or a full job queue)."""
+    from datetime import datetime, timezone
+    from models import User, Lesson
+    cutoff = datetime.now(timezone.utc).isoformat()
+    chunk_size = app.config['PURGE_CHUNK_SIZE']
+    users = supabase.table('users').select('id').lt('deleted_at', cutoff).execute().data or []
+    for row in users:
+        click.echo(f"Account {row['id']}: {User.purge(row['id'])}")
+    while True:
+        rows = supabase.table('lessons').select('id').lt('deleted_at', cutoff) \
+            .order('id').limit(chunk_size).execute().data or []
+        if not rows:
+            break
+        click.echo(f"Lessons: {Lesson.purge_many([row['id'] for row in rows])}")
+    click.echo(f"Done: {len(users)} accounts purged")
+
+@app.cli.command('reindex-search')
+def reindex_search_command():
+    """Rebuild the full-text lesson search index from the lessons table."""
+    from lesson_search import lesson_search
+    lesson_search.clear()
+    lesson_search.load(supabase)
+    click.echo(f"Done: {lesson_search.count()} lessons indexed")
+
+# Preload the role quota table so registration and renewal skip the lookup
+with app.app_context():
+    from models import RoleConfig
+    RoleConfig.load()
+
+@app.cli.command('bench-ledger')
+@click.option('--threads', default=32, show_default=True)
+@click.option('--ops', default=2000, show_default=True, help='Number of ledger operations.')
+@click.option('--backend', type=click.Choice(['memory', 'configured']), default='memory', show_default=True)
+@click.option('--user-id', default=None, help='User to hammer when using the configured backend.')
+@click.option('--balance', default=500, show_default=True, help='Starting balance for the memory backend.')
+def bench_ledger_command(threads, ops, backend, user_id, balance):
+    """Concurrency stress benchmark for the token ledger."""
+    if backend == 'memory':
+        user_id = user_id or 'bench-user'
+        ledger = MemoryLedger({user_id: balance})
+    else:
+        if not user_id:
+            raise click.UsageError('--user-id is required with the configured backend')
+        ledger = app.config["LEDGER"]
+        balance = ledger.balance(user_id)
+    click.echo(f"Done: {stress(ledger, user_id, balance, threads=threads, operations=ops)}")
+
 # Import routes
 from routes import routes
 app.register_blueprint(routes)
@@ -0,0 +1,151 @@
+import logging
+
+from models import User, RoleConfig, USER_DIRECTORY_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+BULK_ACTIONS = ('set_role', 'reset_balance', 'adjust_tokens')
+
+
+def target_chunks(supabase, user_ids=None, filters=None, chunk_size=200):
+    """Yield ``(rows, missing_ids)`` for the targeted users, ``chunk_size`` users at a time.
+
+    Targets are either an explicit id list, fetched with one ``in_`` query per
+    chunk, or the admin directory filters (see ``User.iter_directory``).
+    """
+    if user_ids is not None:
+        for i in range(0, len(user_ids), chunk_size):
+            ids = user_ids[i:i + chunk_size]
+            rows = supabase.table('users').select(USER_DIRECTORY_COLUMNS).in_('id', ids) \
+                .is_('deleted_at', 'null').execute().data or []
+            found = {str(row['id']) for row in rows}
+            yield rows, [user_id for user_id in ids if str(user_id) not in found]
+        return
+    rows = []
+    for row in User.iter_directory(chunk_size=chunk_size, **(filters or {})):
+        rows.append(row)
+        if len(rows) == chunk_size:
+            yield rows, []
+            rows = []
+    if rows:
+        yield rows, []
+
+
+def _refetch(supabase, rows):
+    ids = [row['id'] for row in rows]
+    return supabase.table('users').select(USER_DIRECTORY_COLUMNS).in_('id', ids) \
+        .is_('deleted_at', 'null').execute().data or []
+
+
+def _apply(supabase, ledger_backend, rows, build, reason, meta, attempts=2):
+    """Write new balances for ``rows`` with their ledger rows, one transaction per attempt.
+
+    ``build(row)`` returns the update for a user (see ``SupabaseLedger.apply_many``)
+    from the row as read. A user whose balance changed since the read is
+    re-read and tried again; after ``attempts`` it is reported as failed.
+    """
+    results = []
+    for attempt in range(attempts):
+        applied = ledger_backend.apply_many([build(row) for row in rows], reason, 'admin', meta)
+        for row in rows:
+            if str(row['id']) in applied:
+                results.append({'id': row['id'], 'status': 'updated', 'token_balance': applied[str(row['id'])]})
+        rows = [row for row in rows if str(row['id']) not in applied]
+        if not rows or attempt == attempts - 1:
+            break
+        rows = _refetch(supabase, rows)
+    results.extend({'id': row['id'], 'status': 'failed'} for row in rows)
+    return results
+
+
+def set_role(supabase, ledger_backend, rows, role, reset_balance, meta):
+    quota = RoleConfig.get_quota_for_role(role)
+    if reset_balance:
+        return _apply(supabase, ledger_backend, rows, lambda row: {
+            'id': row['id'],
+            'expected_balance': row.get('token_balance'),
+            'token_balance': quota,
+            'role': role,
+            'monthly_token_quota': quota
+        }, 'admin_reset', meta)
+    # No balance change, so nothing to log: one plain multi-row update
+    response = supabase.table('users').update({'role': role, 'monthly_token_quota': quota}) \
+        .in_('id', [row['id'] for row in rows]).execute()
+    updated = {str(row['id']) for row in response.data or []}
+    return [{'id': row['id'], 'status': 'updated', 'role': role, 'token_balance': row.get('token_balance')}
+            if str(row['id']) in updated else {'id': row['id'], 'status': 'failed'} for row in rows]
+
+
+def reset_balance(supabase, ledger_backend, rows, meta):
+    """Reset balances to each user's role quota."""
+    return _apply(supabase, ledger_backend, rows, lambda row: {
+        'id': row['id'],
+        'expected_balance': row.get('token_balance'),
+        'token_balance': RoleConfig.get_quota_for_role(row.get('role'))
+    }, 'admin_reset', meta)
+
+
+def adjust_tokens(supabase, ledger_backend, rows, adjust, meta):
+    """Add ``adjust`` (negative to revoke) to every balance.
+
+    The chunk is applied in one transaction, guarded on the balances read. A
+    user whose balance changed since the read goes through the single-user
+    ledger RPC instead. Deductions never take a balance below zero.
+    """
+    results = []
+    eligible = []
+    for row in rows:
+        if (row.get('token_balance') or 0) + adjust < 0:
+            results.append({'id': row['id'], 'status': 'insufficient_tokens', 'token_balance': row.get('token_balance')})
+        else:
+            eligible.append(row)
+    applied = ledger_backend.apply_many([{
+        'id': row['id'],
+        'expected_balance': row.get('token_balance'),
+        'token_balance': (row.get('token_balance') or 0) + adjust
+    } for row in eligible], 'admin_adjustment', 'admin', meta) if eligible else {}
+    for row in eligible:
+        balance = applied.get(str(row['id']))
+        if balance is None:
+            balance = ledger_backend.apply(row['id'], adjust, 'admin_adjustment', 'admin', meta)
+        if balance is None:
+            results.append({'id': row['id'], 'status': 'insufficient_tokens'})
+        else:
+            results.append({'id': row['id'], 'status': 'updated', 'token_balance': balance})
+    return results
+
+
+def run_bulk(supabase, ledger_backend, action, user_ids=None, filters=None, role=None,
+             reset=False, adjust=0, admin_id=None, chunk_size=200):
+    """Apply one admin action to many users and return per-user outcomes.
+
+    Each chunk of users is read with one query, and its balance changes and
+    ledger rows are written together in one ``apply_ledger_changes``
+    transaction, so balances and the ledger cannot drift apart. Returns
+    ``{'summary', 'results'}``, where every result has the user ``id`` and a
+    ``status`` of ``updated``, ``not_found``, ``insufficient_tokens`` or
+    ``failed``.
+    """
+    meta = {'admin_id': admin_id, 'bulk': True}
+    results = []
+    for rows, missing in target_chunks(supabase, user_ids, filters, chunk_size):
+        results.extend({'id': user_id, 'status': 'not_found'} for user_id in missing)
+        if not rows:
+            continue
+        try:
+            if action == 'set_role':
+                chunk_results = set_role(supabase, ledger_backend, rows, role, reset, meta)
+            elif action == 'reset_balance':
+                chunk_results = reset_balance(supabase, ledger_backend, rows, meta)
+            else:
+                chunk_results = adjust_tokens(supabase, ledger_backend, rows, adjust, meta)
+        except Exception as e:
+            logger.error(f"Bulk {action} failed for {len(rows)} users: {e}")
+            chunk_results = [{'id': row['id'], 'status': 'failed'} for row in rows]
+        for row in rows:
+            User.invalidate_cache(row['id'])
+        results.extend(chunk_results)
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return {'summary': summary, 'results': results}
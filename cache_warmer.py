@@ -0,0 +1,91 @@
+import logging
+import time
+from collections import Counter
+
+from generation_cache import generation_cache, cache_key, normalize_text
+from lesson_generator import GRADE_VOCABULARY, TEACHING_STRATEGIES, MODEL, generate_lesson_plan
+
+logger = logging.getLogger(__name__)
+
+LANGUAGES = ['English', 'Arabic']
+
+
+def popular_requests(supabase, sample_size=5000, top=200):
+    """Most frequent (grade, topic, strategy, language) among recent lessons."""
+    r = (supabase.table('lessons')
+         .select('grade_level,topic,teaching_strategy,language')
+         .order('date_created', desc=True)
+         .limit(sample_size)
+         .execute())
+    counts = Counter()
+    first_seen = {}
+    for row in r.data or []:
+        combo = (row.get('grade_level'), row.get('topic'), row.get('teaching_strategy'), row.get('language'))
+        if not all(combo):
+            continue
+        norm = tuple(normalize_text(v) for v in combo)
+        counts[norm] += 1
+        first_seen.setdefault(norm, combo)
+    return [first_seen[norm] for norm, _ in counts.most_common(top)]
+
+
+def catalogue_requests(languages=LANGUAGES):
+    """Every grade concept from GRADE_VOCABULARY crossed with every teaching strategy."""
+    for grade, vocab in GRADE_VOCABULARY.items():
+        for concept in vocab['concepts']:
+            for strategy in TEACHING_STRATEGIES:
+                for language in languages:
+                    yield (grade, concept, strategy, language)
+
+
+def warm_cache(supabase=None, languages=LANGUAGES, rate_per_minute=10, max_items=None,
+               max_minutes=None, include_catalogue=True, progress=None):
+    """Pre-generate plans into the generation cache, most-requested first.
+
+    Already-cached combinations are skipped. Calls are spaced to at most
+    ``rate_per_minute``; the run stops after ``max_items`` generations or
+    ``max_minutes`` so it can be confined to quiet hours. ``progress`` is
+    called with the running summary after each item.
+    """
+    candidates = []
+    if supabase is not None:
+        try:
+            candidates.extend(popular_requests(supabase))
+        except Exception as e:
+            logger.error(f"Could not load popular topics: {e}")
+    if include_catalogue:
+        candidates.extend(catalogue_requests(languages))
+
+    summary = {'candidates': len(candidates), 'skipped': 0, 'generated': 0, 'failed': 0,
+               'rate_per_minute': rate_per_minute, 'stopped': None}
+    interval = 60.0 / rate_per_minute if rate_per_minute else 0
+    deadline = time.monotonic() + max_minutes * 60 if max_minutes else None
+    seen = set()
+    last_call = None
+    for grade, topic, strategy, language in candidates:
+        key = cache_key(grade, topic, strategy, language, MODEL)
+        if key in seen or generation_cache.contains(key):
+            summary['skipped'] += 1
+            seen.add(key)
+            continue
+        seen.add(key)
+        if max_items is not None and summary['generated'] + summary['failed'] >= max_items:
+            summary['stopped'] = 'max_items'
+            break
+        if last_call is not None and interval:
+            wait = interval - (time.monotonic() - last_call)
+            if wait > 0:
+                time.sleep(wait)
+        if deadline and time.monotonic() >= deadline:
+            summary['stopped'] = 'max_minutes'
+            break
+        last_call = time.monotonic()
+        try:
+            generate_lesson_plan(grade, topic, strategy, language, force_fresh=True)
+            summary['generated'] += 1
+        except Exception as e:
+            summary['failed'] += 1
+            logger.warning(f"Warm-up failed for grade {grade} / {topic} / {strategy} / {language}: {e}")
+        if progress:
+            progress(summary)
+    return summary
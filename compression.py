@@ -0,0 +1,100 @@
+import logging
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/markdown', 'text/event-stream',
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+}
+
+
+class Compress:
+    """Compress responses with brotli or gzip, negotiated on Accept-Encoding.
+
+    Only textual types are compressed: office documents, images and archives
+    are already compressed and pass through untouched, as do file responses
+    served by ``send_file``. Buffered bodies smaller than ``COMPRESS_MIN_SIZE``
+    are left alone. Streamed responses (lesson generation over SSE) are
+    compressed chunk by chunk with a sync flush, so every event still reaches
+    the client as soon as it is produced.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('COMPRESS_ENABLED', True)
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 500)
+        self.gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', 6)
+        self.brotli_level = app.config.get('COMPRESS_BROTLI_LEVEL', 4)
+        app.after_request(self.after_request)
+
+    def choose(self, request):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted.quality('br') > 0:
+            return 'br'
+        if accepted.quality('gzip') > 0:
+            return 'gzip'
+        return None
+
+    def _compressor(self, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_level)
+            return compressor.process, compressor.flush, compressor.finish
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+        return (compressor.compress,
+                lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+                lambda: compressor.flush(zlib.Z_FINISH))
+
+    def after_request(self, response):
+        from flask import request
+        if (not self.enabled
+                or request.method == 'HEAD'
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.choose(request)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            process, _, finish = self._compressor(encoding)
+            response.set_data(process(data) + finish())
+        response.headers['Content-Encoding'] = encoding
+        # The compressed bytes differ from the identity representation, so a strong validator would lie
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _stream(self, chunks, encoding):
+        process, flush, finish = self._compressor(encoding)
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                yield process(chunk) + flush()
+            yield finish()
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+
+
+compress = Compress()
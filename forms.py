@@ -1,7 +1,7 @@
 from flask import current_app
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed, FileRequired
-from wtforms import StringField, PasswordField, SelectField, TextAreaField, SubmitField, IntegerField
+from wtforms import StringField, PasswordField, SelectField, TextAreaField, SubmitField, IntegerField, BooleanField, HiddenField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, Optional, NumberRange
 from models import User
 from flask_login import current_user
@@ -62,11 +62,15 @@ class LessonForm(FlaskForm):
     topic = StringField('Lesson Topic', validators=[DataRequired(), Length(min=3, max=200)])
     language = SelectField('language', choices=Lang, validators=[DataRequired()])
     teaching_strategy = SelectField('Teaching Strategy', choices=STRATEGY_CHOICES, validators=[DataRequired()])
+    force_fresh = BooleanField('Generate a fresh plan')
+    fast_draft = BooleanField('Instant draft')
     submit = SubmitField('Generate Lesson Plan')
 
 class EditLessonForm(FlaskForm):
     generated_plan = TextAreaField('Generated Plan', validators=[DataRequired()])
     gpt_plan = TextAreaField('GPT Plan', validators=[DataRequired()])
+    # date_modified of the lesson as loaded, to reject saves over newer edits
+    version = HiddenField()
     submit = SubmitField('Save Changes')
 
 class ARLessonForm(FlaskForm):
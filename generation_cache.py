@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(value):
+    return ' '.join(str(value or '').split()).casefold()
+
+
+def cache_key(grade_level, topic, strategy, language, model):
+    """Stable key for a generation request; case and whitespace differences don't matter."""
+    parts = [normalize_text(v) for v in (grade_level, topic, strategy, language, model)]
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class GenerationCache:
+    """Disk-backed LRU cache of generated lesson plans, stored in SQLite.
+
+    Entries older than ``ttl`` seconds are treated as misses, and the least
+    recently used rows are evicted once there are more than ``max_entries``.
+    The database is opened lazily, one connection per thread.
+    """
+
+    def __init__(self, path, max_entries=5000, ttl=30 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS generations ('
+                ' key TEXT PRIMARY KEY,'
+                ' model TEXT,'
+                ' plan TEXT NOT NULL,'
+                ' created_at REAL NOT NULL,'
+                ' last_used REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_generations_last_used ON generations (last_used)')
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        try:
+            conn = self._conn()
+            row = conn.execute('SELECT plan, created_at FROM generations WHERE key = ?', (key,)).fetchone()
+            now = time.time()
+            if row and (not self.ttl or now - row[1] < self.ttl):
+                conn.execute('UPDATE generations SET last_used = ? WHERE key = ?', (now, key))
+                conn.commit()
+                with self._lock:
+                    self.hits += 1
+                return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Generation cache read failed: {e}")
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get_since(self, key, since):
+        """Return the plan only if it was stored after ``since`` (a Unix time); no LRU or counter updates."""
+        try:
+            row = self._conn().execute(
+                'SELECT plan FROM generations WHERE key = ? AND created_at >= ?', (key, since)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def set(self, key, plan, model=None):
+        if not plan:
+            return
+        try:
+            conn = self._conn()
+            now = time.time()
+            conn.execute(
+                'INSERT OR REPLACE INTO generations (key, model, plan, created_at, last_used) VALUES (?, ?, ?, ?, ?)',
+                (key, model, plan, now, now)
+            )
+            conn.commit()
+            with self._lock:
+                self._writes += 1
+                evict = self._writes % 100 == 0
+            if evict:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.warning(f"Generation cache write failed: {e}")
+
+    def contains(self, key):
+        """True if ``key`` has a fresh entry; does not touch LRU order or counters."""
+        try:
+            row = self._conn().execute('SELECT created_at FROM generations WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error:
+            return False
+        return bool(row) and (not self.ttl or time.time() - row[0] < self.ttl)
+
+    def evict(self):
+        """Drop expired rows, then the least recently used beyond ``max_entries``."""
+        conn = self._conn()
+        if self.ttl:
+            conn.execute('DELETE FROM generations WHERE created_at < ?', (time.time() - self.ttl,))
+        conn.execute(
+            'DELETE FROM generations WHERE key IN ('
+            ' SELECT key FROM generations ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+        conn.commit()
+
+    def stats(self):
+        try:
+            size = self._conn().execute('SELECT COUNT(*) FROM generations').fetchone()[0]
+        except sqlite3.Error:
+            size = None
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'entries': size,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0
+        }
+
+
+generation_cache = GenerationCache(
+    os.environ.get("GENERATION_CACHE_PATH", "generation_cache.sqlite3"),
+    max_entries=int(os.environ.get("GENERATION_CACHE_MAX_ENTRIES", 5000)),
+    ttl=int(os.environ.get("GENERATION_CACHE_TTL", 30 * 24 * 3600))
+)
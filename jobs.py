@@ -0,0 +1,253 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, user_id, kind):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.kind = kind
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.date_created = datetime.now(timezone.utc).isoformat()
+        self.date_finished = None
+        self.finished_at = None
+        self.chunks = []
+        self._cond = threading.Condition()
+        self._on_change = None
+        self._saved_at = 0
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def append(self, text):
+        """Publish a partial-output chunk to anyone following the job."""
+        with self._cond:
+            self.chunks.append(text)
+            self._cond.notify_all()
+        self._changed()
+
+    def notify(self):
+        """Wake followers after ``result`` was changed in place."""
+        with self._cond:
+            self._cond.notify_all()
+        self._changed()
+
+    def _changed(self):
+        if self._on_change:
+            self._on_change(self)
+
+    def read(self, offset, timeout=15):
+        """Return chunks published after ``offset``, waiting up to ``timeout`` for new ones."""
+        with self._cond:
+            if len(self.chunks) <= offset and not self.finished:
+                self._cond.wait(timeout)
+            return self.chunks[offset:]
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'date_created': self.date_created,
+            'date_finished': self.date_finished
+        }
+
+
+class StoredJob(Job):
+    """A job running in another process, followed through its ``jobs`` row.
+
+    ``read`` polls the row, and output saved since the last poll becomes a
+    new chunk, so callers can treat it like a local Job.
+    """
+
+    def __init__(self, queue, row):
+        super().__init__(row.get('user_id'), row.get('kind'))
+        self.id = row['id']
+        self.date_created = row.get('date_created')
+        self._queue = queue
+        self._output = ''
+        self._refresh(row)
+
+    def _refresh(self, row):
+        self.status = row.get('status') or QUEUED
+        self.result = row.get('result')
+        self.error = row.get('error')
+        self.date_finished = row.get('date_finished')
+        output = row.get('output') or ''
+        if len(output) > len(self._output):
+            self.chunks.append(output[len(self._output):])
+            self._output = output
+
+    def read(self, offset, timeout=15):
+        deadline = time.monotonic() + timeout
+        while len(self.chunks) <= offset and not self.finished and time.monotonic() < deadline:
+            time.sleep(min(self._queue.poll_interval, max(deadline - time.monotonic(), 0)))
+            row = self._queue._load(self.id)
+            if row:
+                self._refresh(row)
+        return self.chunks[offset:]
+
+
+class JobQueue:
+    """Bounded background worker pool for slow work such as LLM calls.
+
+    Jobs run inside an application context so task functions can use the
+    models exactly like a request handler. Each job's status, result and
+    output are also written to the ``jobs`` table (at most every
+    JOB_SAVE_INTERVAL seconds while it runs), so a poll or SSE request that
+    lands on another worker still finds it.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.store = None
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._pruned_at = 0
+        self.max_pending = 100
+        self.retention = 3600
+        self.save_interval = 1.0
+        self.poll_interval = 1.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.store = app.config.get('SUPABASE_CLIENT')
+        self.max_pending = int(app.config.get('JOB_MAX_PENDING', 100))
+        self.retention = int(app.config.get('JOB_RETENTION_SECONDS', 3600))
+        self.save_interval = float(app.config.get('JOB_SAVE_INTERVAL', 1.0))
+        self.poll_interval = float(app.config.get('JOB_POLL_INTERVAL', 1.0))
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(app.config.get('JOB_WORKERS', 4)),
+            thread_name_prefix='lesson-job'
+        )
+        app.extensions['job_queue'] = self
+
+    def submit(self, user_id, kind, fn, *args, **kwargs):
+        """Queue ``fn(job, *args, **kwargs)`` and return the new Job.
+
+        Raises QueueFull when ``max_pending`` jobs are already waiting or
+        running, so callers can answer 503 instead of piling up work.
+        """
+        job = Job(user_id, kind)
+        with self._lock:
+            self._prune()
+            if self._pending >= self.max_pending:
+                raise QueueFull('Too many pending jobs')
+            self._pending += 1
+            self._jobs[job.id] = job
+        self._prune_store()
+        job._on_change = self._save
+        self._insert(job)
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """The job with ``job_id``, whichever worker runs it, or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            row = self._load(job_id)
+            job = StoredJob(self, row) if row else None
+        return job
+
+    def _row(self, job):
+        return {
+            'status': job.status,
+            'result': job.result,
+            'error': job.error,
+            'output': ''.join(job.chunks),
+            'date_finished': job.date_finished
+        }
+
+    def _insert(self, job):
+        if self.store is None:
+            return
+        try:
+            self.store.table('jobs').insert({
+                'id': job.id, 'user_id': str(job.user_id), 'kind': job.kind,
+                'date_created': job.date_created, **self._row(job)
+            }).execute()
+        except Exception as e:
+            logger.error(f"Could not record job {job.id}; other workers won't find it: {e}")
+
+    def _save(self, job, force=False):
+        if self.store is None or (not force and time.monotonic() - job._saved_at < self.save_interval):
+            return
+        job._saved_at = time.monotonic()
+        try:
+            self.store.table('jobs').update(self._row(job)).eq('id', job.id).execute()
+        except Exception as e:
+            logger.error(f"Could not save job {job.id}: {e}")
+
+    def _load(self, job_id):
+        if self.store is None:
+            return None
+        try:
+            rows = self.store.table('jobs').select('*').eq('id', job_id).limit(1).execute().data
+        except Exception as e:
+            logger.error(f"Could not load job {job_id}: {e}")
+            return None
+        return rows[0] if rows else None
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = RUNNING
+        self._save(job, force=True)
+        try:
+            with self.app.app_context():
+                job.result = fn(job, *args, **kwargs)
+            job.status = DONE
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.date_finished = datetime.now(timezone.utc).isoformat()
+            job.finished_at = time.monotonic()
+            self._save(job, force=True)
+            job.notify()
+            with self._lock:
+                self._pending -= 1
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _prune_store(self):
+        # Stored rows are shared by all workers; any of them may clear old ones, once a minute at most
+        if self.store is not None and time.monotonic() - self._pruned_at >= 60:
+            self._pruned_at = time.monotonic()
+            cutoff_date = datetime.fromtimestamp(time.time() - self.retention, timezone.utc).isoformat()
+            try:
+                self.store.table('jobs').delete().lt('date_created', cutoff_date).execute()
+            except Exception as e:
+                logger.error(f"Could not prune stored jobs: {e}")
+
+
+job_queue = JobQueue()
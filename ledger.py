@@ -0,0 +1,138 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+
+class SupabaseLedger:
+    """Token ledger backed by the ``apply_ledger_change`` Postgres function.
+
+    The balance update and the token_transactions insert happen in one
+    database transaction and one round trip (see sql/apply_ledger_change.sql).
+    """
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    def apply(self, user_id, change, reason, source, meta=None, allow_negative=False):
+        """Apply ``change`` and log it; returns the new balance, or None if it would go negative."""
+        r = self.supabase.rpc('apply_ledger_change', {
+            'p_user_id': user_id,
+            'p_change': change,
+            'p_reason': reason,
+            'p_source': source,
+            'p_meta': meta,
+            'p_allow_negative': allow_negative
+        }).execute()
+        return r.data
+
+    def apply_many(self, updates, reason, source, meta=None):
+        """Set several balances and log the changes in one transaction (sql/apply_ledger_changes.sql).
+
+        ``updates`` are dicts with ``id``, ``expected_balance`` and
+        ``token_balance`` (optionally ``role``, ``monthly_token_quota`` and
+        ``token_renewal_date``); a user is only updated if its balance still
+        equals ``expected_balance``.
+        Returns ``{str(user_id): new_balance}`` for the users updated.
+        """
+        r = self.supabase.rpc('apply_ledger_changes', {
+            'p_updates': updates,
+            'p_reason': reason,
+            'p_source': source,
+            'p_meta': meta
+        }).execute()
+        return {str(row['id']): row['token_balance'] for row in r.data or []}
+
+    def balance(self, user_id):
+        r = self.supabase.table('users').select('token_balance').eq('id', user_id).single().execute()
+        return (r.data or {}).get('token_balance')
+
+
+class MemoryLedger:
+    """In-process ledger with the same semantics, for tests and benchmarks."""
+
+    def __init__(self, balances=None):
+        self.balances = dict(balances or {})
+        self.transactions = []
+        self._lock = threading.Lock()
+
+    def apply(self, user_id, change, reason, source, meta=None, allow_negative=False):
+        with self._lock:
+            if user_id not in self.balances:
+                return None
+            new_balance = (self.balances[user_id] or 0) + change
+            if new_balance < 0 and not allow_negative:
+                return None
+            self.balances[user_id] = new_balance
+            self.transactions.append({
+                'user_id': user_id,
+                'change': change,
+                'reason': reason,
+                'source': source,
+                'meta': meta,
+                'date_created': datetime.now(timezone.utc).isoformat()
+            })
+            return new_balance
+
+    def apply_many(self, updates, reason, source, meta=None):
+        with self._lock:
+            applied = {}
+            for update in updates:
+                user_id = update['id']
+                if user_id not in self.balances or self.balances[user_id] != update['expected_balance']:
+                    continue
+                self.balances[user_id] = update['token_balance']
+                applied[str(user_id)] = update['token_balance']
+                change = (update['token_balance'] or 0) - (update['expected_balance'] or 0)
+                if change:
+                    self.transactions.append({
+                        'user_id': user_id,
+                        'change': change,
+                        'reason': reason,
+                        'source': source,
+                        'meta': meta,
+                        'date_created': datetime.now(timezone.utc).isoformat()
+                    })
+            return applied
+
+    def balance(self, user_id):
+        with self._lock:
+            return self.balances.get(user_id)
+
+
+def stress(ledger, user_id, initial_balance, threads=32, operations=2000):
+    """Hammer one user's balance from many threads and check the ledger invariants.
+
+    Mixes 1-token deductions with occasional top-ups. Returns a summary with
+    throughput and whether the final balance equals the initial balance plus
+    the sum of accepted changes, without ever going negative.
+    """
+    accepted = []
+    lock = threading.Lock()
+
+    def worker(i):
+        change = 3 if i % 10 == 0 else -1
+        balance = ledger.apply(user_id, change, 'stress_test', 'bench')
+        if balance is not None:
+            with lock:
+                accepted.append((change, balance))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, random.sample(range(operations), operations)))
+    elapsed = time.perf_counter() - start
+
+    expected = initial_balance + sum(change for change, _ in accepted)
+    final = ledger.balance(user_id)
+    return {
+        'operations': operations,
+        'accepted': len(accepted),
+        'rejected': operations - len(accepted),
+        'seconds': round(elapsed, 4),
+        'ops_per_second': round(operations / elapsed, 1) if elapsed else None,
+        'final_balance': final,
+        'expected_balance': expected,
+        'never_negative': all(balance >= 0 for _, balance in accepted),
+        'consistent': final == expected
+    }
@@ -1,11 +1,12 @@
+import time
+import zlib
+from generation_cache import generation_cache, cache_key
+from llm_providers import build_provider, is_timeout
+from metrics import record_llm_call
+from single_flight import single_flight
 
-import os
-from openai import OpenAI
-
-client = OpenAI(
-  base_url="https://openrouter.ai/api/v1",
-  api_key=os.environ.get("aiAPI"),
-)
+provider = build_provider()
+MODEL = provider.model
 
 
 # Templates for lesson plan sections
@@ -278,26 +279,138 @@ TEACHING_STRATEGIES = {
     }
 }
 
-def generate_lesson_plan(grade_level, topic, strategy,language):
-    language_ = str(language)
-    grade_level_ = str(grade_level)
-    topic_ = str(topic)
-    strategy_ = str(strategy)
-    completion = client.chat.completions.create(
-  extra_headers={
-    "HTTP-Referer": "<YOUR_SITE_URL>", # Optional. Site URL for rankings on openrouter.ai.
-    "X-Title": "<YOUR_SITE_NAME>", # Optional. Site title for rankings on openrouter.ai.
-  },
-  extra_body={},
-  model="arcee-ai/trinity-large-preview:free",
-  messages=[
-    {
-      "role": "user",
-      "content": f"Create an engaging and detailed lesson plan in  {language_}  for grade {grade_level_} on the topic {topic_}  , using the strategy {strategy_} . Make sure the plan includes clear learning objectives, interactive activities, and effective ways to assess student understanding."
-    }
-  ]
-)
-    return (completion.choices[0].message.content)
+def _outcome(error):
+    return 'timeout' if is_timeout(error) else 'error'
+
+def generate_lesson_plan(grade_level, topic, strategy,language, force_fresh=False):
+    """Return a plan from the cache or the LLM.
+
+    Concurrent identical requests share one upstream call (see single_flight).
+    """
+    start = time.monotonic()
+    key = cache_key(grade_level, topic, strategy, language, MODEL)
+    if not force_fresh:
+        cached = generation_cache.get(key)
+        if cached is not None:
+            record_llm_call(MODEL, 'cache_hit', language, grade_level, time.monotonic() - start)
+            return cached
+
+    def call():
+        usage = {}
+        try:
+            plan = provider.complete(gpt_plans(grade_level, topic, strategy, language), usage)
+        except Exception as e:
+            record_llm_call(MODEL, _outcome(e), language, grade_level, time.monotonic() - start)
+            raise
+        record_llm_call(MODEL, 'success', language, grade_level, time.monotonic() - start, usage=usage)
+        generation_cache.set(key, plan, MODEL)
+        return plan
+
+    return single_flight.do(key, call, recheck=lambda since: generation_cache.get_since(key, since))
+
+def stream_lesson_plan(grade_level, topic, strategy, language, force_fresh=False):
+    """Same request as generate_lesson_plan, but yields text chunks as the model produces them.
+
+    A cache hit is yielded as a single chunk.
+    """
+    start = time.monotonic()
+    key = cache_key(grade_level, topic, strategy, language, MODEL)
+    if not force_fresh:
+        cached = generation_cache.get(key)
+        if cached is not None:
+            record_llm_call(MODEL, 'cache_hit', language, grade_level, time.monotonic() - start)
+            yield cached
+            return
+
+    def call():
+        parts = []
+        usage = {}
+        ttft = None
+        try:
+            for text in provider.stream(gpt_plans(grade_level, topic, strategy, language), usage):
+                if ttft is None:
+                    ttft = time.monotonic() - start
+                parts.append(text)
+                yield text
+        except Exception as e:
+            record_llm_call(MODEL, _outcome(e), language, grade_level, time.monotonic() - start, ttft)
+            raise
+        record_llm_call(MODEL, 'success', language, grade_level, time.monotonic() - start, ttft, usage)
+        generation_cache.set(key, ''.join(parts), MODEL)
+
+    yield from single_flight.stream(key, call, recheck=lambda since: generation_cache.get_since(key, since))
+
+def _pick(options, seed, count=1):
+    """Deterministically pick ``count`` distinct items from ``options`` based on ``seed``."""
+    start = seed % len(options)
+    return [options[(start + i) % len(options)] for i in range(min(count, len(options)))]
+
+def fast_draft_available(language):
+    """Whether ``generate_fast_draft`` writes in ``language``; its tables are English-only."""
+    return str(language or 'English').strip().casefold() in ('english', 'en')
+
+
+def generate_fast_draft(grade_level, topic, strategy, language=None):
+    """Build a complete structured plan locally from the template tables.
+
+    Deterministic for the same inputs and takes well under a millisecond,
+    so it is used for "fast mode" and as a fallback when the LLM is
+    unavailable. The section layout matches what ppt_generator parses.
+    The tables are English-only, so the draft is always in English.
+    """
+    topic = str(topic or '').strip()
+    grade = str(grade_level or '').strip().upper()
+    vocab = GRADE_VOCABULARY.get(grade, GRADE_VOCABULARY['5'])
+    strategy_key = strategy if strategy in TEACHING_STRATEGIES else 'direct_instruction'
+    details = TEACHING_STRATEGIES[strategy_key]
+    strategy_name = strategy_key.replace('_', ' ').title()
+    seed = zlib.crc32(f"{grade}|{topic.casefold()}|{strategy_key}".encode('utf-8'))
+
+    verbs = _pick(vocab['verbs'], seed, 3)
+    activities = _pick(details['activities'], seed, 3)
+    assessments = _pick(details['assessment'], seed >> 3, 3)
+
+    lines = [
+        f"# Lesson Plan: {topic}",
+        "",
+        "## Overview",
+        f"**Grade Level:** {grade or vocab['complexity']}",
+        f"**Topic:** {topic}",
+        f"**Teaching Strategy:** {strategy_name}",
+        f"**Duration:** {vocab['duration']}",
+        "",
+        f"{strategy_name}: {details['description']}.",
+        "",
+        "## Objectives",
+        _pick(OBJECTIVES_TEMPLATES, seed)[0],
+    ]
+    lines += [f"• {verb.capitalize()} the key ideas of {topic}" for verb in verbs[:2]]
+    lines += [
+        f"• {verbs[-1].capitalize()} how {topic} applies to everyday situations",
+        "",
+        "## Introduction",
+        _pick(INTRODUCTION_TEMPLATES, seed >> 7)[0].format(topic=topic),
+        f"• Activate prior knowledge with a short question about {topic}",
+        "• Share the lesson objectives and success criteria",
+        "",
+        "## Main Activities",
+        _pick(MAIN_ACTIVITY_TEMPLATES, seed >> 9)[0],
+    ]
+    lines += [f"• {activity}" for activity in activities]
+    lines += [
+        "",
+        "## Assessment",
+        _pick(ASSESSMENT_TEMPLATES, seed >> 11)[0],
+    ]
+    lines += [f"• {assessment}" for assessment in assessments]
+    lines += [
+        "",
+        "## Conclusion",
+        _pick(CONCLUSION_TEMPLATES, seed >> 13)[0].format(topic=topic),
+        f"• Students summarize what they learned about {topic}",
+        "• Answer remaining questions and preview the next lesson",
+    ]
+    return "\n".join(lines)
 
 def gpt_plans(grade_level, topic, strategy, language):
     language_ = str(language)
@@ -0,0 +1,227 @@
+import html
+import logging
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+from types import SimpleNamespace
+
+from topic_index import normalize_topic
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r'\w+')
+ARABIC_PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')
+ENGLISH_SUFFIXES = (
+    ('ational', 'ate'), ('ization', 'ize'), ('ations', 'ate'), ('ation', 'ate'),
+    ('fulness', 'ful'), ('iveness', 'ive'), ('ousness', 'ous'),
+    ('ments', ''), ('ment', ''), ('ness', ''), ('ingly', ''), ('edly', ''),
+    ('ing', ''), ('ies', 'y'), ('ied', 'y'), ('ed', ''), ('ly', ''),
+)
+
+
+def stem(word):
+    """Light stemmer: strips common English suffixes and the Arabic definite article."""
+    if word.isascii():
+        if len(word) <= 3:
+            return word
+        for suffix, replacement in ENGLISH_SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+                word = word[:-len(suffix)] + replacement
+                if suffix in ('ing', 'ed', 'ingly', 'edly') and len(word) > 3 \
+                        and word[-1] == word[-2] and word[-1] not in 'lsz':
+                    word = word[:-1]
+                break
+        else:
+            if word.endswith(('sses', 'xes', 'zes', 'ches', 'shes')):
+                word = word[:-2]
+            elif word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+                word = word[:-1]
+        if word.endswith('e') and len(word) > 4:
+            word = word[:-1]
+        return word
+    for prefix in ARABIC_PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= 3:
+            return word[len(prefix):]
+    return word
+
+
+def analyze(text):
+    """Normalized, stemmed terms of ``text``, in order."""
+    return [stem(w) for w in normalize_topic(text).split()]
+
+
+@lru_cache(maxsize=100000)
+def _term(word):
+    analyzed = analyze(word)
+    return analyzed[0] if analyzed else ''
+
+
+def snippet(text, terms, prefix=None, width=30):
+    """HTML-escaped excerpt of ``text`` around the densest run of matching words, matches in <mark>."""
+    words = list(WORD.finditer(text or ''))
+    if not words:
+        return ''
+    hits = []
+    for i, w in enumerate(words):
+        term = _term(w.group())
+        if term and (term in terms or (prefix and term.startswith(prefix))):
+            hits.append(i)
+    start, best, j = 0, 0, 0
+    for i, first in enumerate(hits):
+        while hits[j] < first - width + 1:
+            j += 1
+        if i - j + 1 > best:
+            best, start = i - j + 1, max(0, hits[j] - 3)
+    end = min(len(words), start + width)
+    hit_set = set(hits)
+    out, pos = [], words[start].start()
+    for i in range(start, end):
+        w = words[i]
+        out.append(html.escape(text[pos:w.start()]))
+        out.append(f'<mark>{html.escape(w.group())}</mark>' if i in hit_set else html.escape(w.group()))
+        pos = w.end()
+    excerpt = ' '.join(''.join(out).split())
+    return f"{'… ' if start else ''}{excerpt}{' …' if end < len(words) else ''}"
+
+
+class LessonSearchIndex:
+    """Per-user full-text index over lesson topics and plans, in SQLite FTS5.
+
+    Text is indexed after Arabic folding (see ``normalize_topic``) and light
+    stemming, so queries match across spelling and inflection variants.
+    Each document also carries an owner token, so a user's query is an
+    intersection of posting lists rather than a filter over every match.
+    Results are ranked with BM25, weighting the topic above the plan body.
+    The original text is kept alongside for snippets.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS lesson_fts USING fts5("
+                " owner, topic, body, tokenize='unicode61 remove_diacritics 2')"
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS lesson_docs ('
+                ' lesson_id INTEGER PRIMARY KEY,'
+                ' user_id TEXT NOT NULL,'
+                ' topic TEXT,'
+                ' body TEXT,'
+                ' grade_level TEXT,'
+                ' teaching_strategy TEXT,'
+                ' language TEXT,'
+                ' date_created TEXT)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_lesson_docs_user ON lesson_docs (user_id)')
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _owner(user_id):
+        return f"owner{user_id}".replace('-', '')
+
+    def add(self, lesson):
+        """Index or re-index a lesson (anything with the Lesson attributes)."""
+        try:
+            conn = self._conn()
+            body = lesson.generated_plan or ''
+            with conn:
+                conn.execute('DELETE FROM lesson_fts WHERE rowid = ?', (lesson.id,))
+                conn.execute(
+                    'INSERT INTO lesson_fts (rowid, owner, topic, body) VALUES (?, ?, ?, ?)',
+                    (lesson.id, self._owner(lesson.user_id), ' '.join(analyze(lesson.topic)), ' '.join(analyze(body)))
+                )
+                conn.execute(
+                    'INSERT OR REPLACE INTO lesson_docs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (lesson.id, str(lesson.user_id), lesson.topic, body, lesson.grade_level,
+                     lesson.teaching_strategy, lesson.language, lesson.date_created)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Search index update failed for lesson {lesson.id}: {e}")
+
+    def remove(self, lesson_id):
+        try:
+            with self._conn() as conn:
+                conn.execute('DELETE FROM lesson_fts WHERE rowid = ?', (lesson_id,))
+                conn.execute('DELETE FROM lesson_docs WHERE lesson_id = ?', (lesson_id,))
+        except sqlite3.Error as e:
+            logger.warning(f"Search index removal failed for lesson {lesson_id}: {e}")
+
+    def remove_user(self, user_id):
+        try:
+            with self._conn() as conn:
+                conn.execute('DELETE FROM lesson_fts WHERE rowid IN '
+                             '(SELECT lesson_id FROM lesson_docs WHERE user_id = ?)', (str(user_id),))
+                conn.execute('DELETE FROM lesson_docs WHERE user_id = ?', (str(user_id),))
+        except sqlite3.Error as e:
+            logger.warning(f"Search index removal failed for user {user_id}: {e}")
+
+    def search(self, user_id, query, limit=20, offset=0):
+        """Best matches for ``query`` among the user's lessons; the last word also matches as a prefix."""
+        terms = analyze(query)
+        if not terms:
+            return []
+        prefix = terms[-1]
+        expr = ' '.join(f'"{t}"' for t in terms[:-1])
+        expr = f'owner: {self._owner(user_id)} AND {{topic body}}: ({expr} "{prefix}"*)'
+        rows = self._conn().execute(
+            'SELECT d.lesson_id, d.topic, d.body, d.grade_level, d.teaching_strategy, d.language,'
+            ' d.date_created, bm25(lesson_fts, 0.0, 10.0, 1.0) AS score'
+            ' FROM lesson_fts JOIN lesson_docs d ON d.lesson_id = lesson_fts.rowid'
+            ' WHERE lesson_fts MATCH ? ORDER BY score LIMIT ? OFFSET ?',
+            (expr, limit, offset)
+        ).fetchall()
+        exact = set(terms[:-1])
+        return [{
+            'id': lesson_id,
+            'topic': topic,
+            'grade_level': grade_level,
+            'teaching_strategy': teaching_strategy,
+            'language': language,
+            'date_created': date_created,
+            'score': round(-score, 4),
+            'topic_highlight': snippet(topic, exact, prefix, width=50),
+            'snippet': snippet(body, exact, prefix)
+        } for lesson_id, topic, body, grade_level, teaching_strategy, language, date_created, score in rows]
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM lesson_fts')
+            conn.execute('DELETE FROM lesson_docs')
+
+    def count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM lesson_docs').fetchone()[0]
+
+    def load(self, supabase, page_size=500):
+        """(Re)build the index from the live lessons of live accounts, a page at a time."""
+        start = 0
+        while True:
+            r = (supabase.table('lessons')
+                 .select('id,user_id,topic,generated_plan,grade_level,teaching_strategy,language,date_created,'
+                         'users!inner(deleted_at)')
+                 .is_('deleted_at', 'null')
+                 .is_('users.deleted_at', 'null')
+                 .order('id')
+                 .range(start, start + page_size - 1)
+                 .execute())
+            rows = r.data or []
+            for row in rows:
+                self.add(SimpleNamespace(**row))
+            if len(rows) < page_size:
+                break
+            start += page_size
+        logger.info(f"Search index loaded with {self.count()} lessons")
+
+
+lesson_search = LessonSearchIndex(os.environ.get("LESSON_SEARCH_PATH", "lesson_search.sqlite3"))
@@ -0,0 +1,393 @@
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import httpx
+import openai
+from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class LatencyWindow:
+    """Rolling window of recent call latencies, used to decide when to hedge."""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+class StreamPump:
+    """Drive a chunk iterator on a background thread, so callers can wait for it with a timeout.
+
+    ``wait_started(timeout)`` reports whether the first chunk (or the end of
+    the stream, or its error) arrived in time; iterating the pump then yields
+    the chunks. ``cancel`` stops reading after the chunk in flight and closes
+    the underlying stream. ``ready``, if given, is set when the first event
+    arrives, so one waiter can watch several pumps.
+    """
+
+    def __init__(self, chunks, ready=None):
+        self.started_at = time.monotonic()
+        self.first_chunk_at = None
+        self._chunks = chunks
+        self._ready = ready
+        self._queue = queue.Queue()
+        self._head = None
+        self._cancelled = threading.Event()
+        threading.Thread(target=self._run, name='llm-stream', daemon=True).start()
+
+    def _put(self, event):
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.monotonic()
+            if self._ready is not None:
+                self._ready.set()
+        self._queue.put(event)
+
+    def _run(self):
+        try:
+            for chunk in self._chunks:
+                if self._cancelled.is_set():
+                    break
+                self._put(('chunk', chunk))
+            else:
+                self._put(('done', None))
+        except Exception as e:
+            self._put(('error', e))
+        finally:
+            close = getattr(self._chunks, 'close', None)
+            if close:
+                close()
+
+    def wait_started(self, timeout=None):
+        if self._head is None:
+            try:
+                self._head = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return False
+        return True
+
+    @property
+    def failed(self):
+        return self._head is not None and self._head[0] == 'error'
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def __iter__(self):
+        try:
+            while True:
+                if self._head is not None:
+                    (kind, value), self._head = self._head, None
+                else:
+                    kind, value = self._queue.get()
+                if kind == 'chunk':
+                    yield value
+                elif kind == 'error':
+                    raise value
+                else:
+                    return
+        finally:
+            self.cancel()
+
+
+def is_timeout(error):
+    return isinstance(error, (openai.APITimeoutError, httpx.TimeoutException, TimeoutError))
+
+
+def _record_usage(usage, reported):
+    if usage is not None and reported is not None:
+        usage['prompt_tokens'] = getattr(reported, 'prompt_tokens', None)
+        usage['completion_tokens'] = getattr(reported, 'completion_tokens', None)
+
+
+class Provider:
+    """A chat model behind a uniform ``complete``/``stream`` interface.
+
+    Both methods take an optional ``usage`` dict, which is filled with the
+    provider-reported ``prompt_tokens``/``completion_tokens`` when known.
+    """
+
+    name = 'base'
+    model = None
+
+    def complete(self, prompt, usage=None):
+        raise NotImplementedError
+
+    def stream(self, prompt, usage=None):
+        yield self.complete(prompt, usage)
+
+
+class OpenAIProvider(Provider):
+    """Any OpenAI-compatible endpoint (OpenRouter by default).
+
+    Each provider owns its own pooled HTTP client with explicit timeouts.
+    Retryable failures are retried with jittered exponential backoff; a
+    stream is only retried if it fails before the first chunk.
+    """
+
+    def __init__(self, name, base_url, api_key, model, timeout=60.0, connect_timeout=5.0,
+                 max_retries=2, backoff=0.5, pool_size=20, extra_headers=None):
+        self.name = name
+        self.model = model
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.extra_headers = extra_headers or {}
+        self.client = OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            max_retries=0,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            http_client=httpx.Client(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            ),
+        )
+
+    def _request(self, prompt, stream=False):
+        options = {'stream_options': {'include_usage': True}} if stream else {}
+        return self.client.chat.completions.create(
+            extra_headers=self.extra_headers,
+            extra_body={},
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=stream,
+            **options
+        )
+
+    def _sleep_before_retry(self, attempt, error):
+        delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        logger.warning(f"{self.name} call failed ({error}); retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        time.sleep(delay)
+
+    def complete(self, prompt, usage=None):
+        for attempt in range(self.max_retries + 1):
+            try:
+                completion = self._request(prompt)
+                _record_usage(usage, completion.usage)
+                return completion.choices[0].message.content
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                self._sleep_before_retry(attempt, e)
+
+    def stream(self, prompt, usage=None):
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                for chunk in self._request(prompt, stream=True):
+                    _record_usage(usage, getattr(chunk, 'usage', None))
+                    if not chunk.choices:
+                        continue
+                    text = chunk.choices[0].delta.content
+                    if text:
+                        started = True
+                        yield text
+                return
+            except RETRYABLE_ERRORS as e:
+                if started or attempt == self.max_retries:
+                    raise
+                self._sleep_before_retry(attempt, e)
+
+
+class StubProvider(Provider):
+    """Offline provider returning a canned plan, for tests and benchmarks.
+
+    ``latency`` (seconds) simulates upstream time; ``chunk_size`` controls
+    how the text is split when streaming.
+    """
+
+    def __init__(self, name='stub', model='stub', latency=0.0, chunk_size=40):
+        self.name = name
+        self.model = model
+        self.latency = latency
+        self.chunk_size = chunk_size
+
+    def _text(self, prompt):
+        return f"# Lesson Plan\n\n{prompt}\n\n## Objectives\n- Placeholder objective\n"
+
+    def complete(self, prompt, usage=None):
+        if self.latency:
+            time.sleep(self.latency)
+        text = self._text(prompt)
+        self._usage(usage, prompt, text)
+        return text
+
+    def _usage(self, usage, prompt, text):
+        if usage is not None:
+            usage['prompt_tokens'] = len(prompt.split())
+            usage['completion_tokens'] = len(text.split())
+
+    def stream(self, prompt, usage=None):
+        text = self._text(prompt)
+        self._usage(usage, prompt, text)
+        step = self.latency / max(1, len(text) // self.chunk_size) if self.latency else 0
+        for i in range(0, len(text), self.chunk_size):
+            if step:
+                time.sleep(step)
+            yield text[i:i + self.chunk_size]
+
+
+class HedgedProvider(Provider):
+    """Send a backup request to a second provider when the primary is slow.
+
+    Once the primary call has run longer than the ``percentile`` of its
+    recent latencies (after ``min_samples`` calls), the same prompt is sent
+    to ``backup`` and whichever answers first wins. Streams are hedged up to
+    the first chunk: if the primary has produced nothing after the
+    percentile of its recent times to first chunk, the backup stream is
+    started and the first one to produce text is followed to the end.
+    """
+
+    def __init__(self, primary, backup, percentile=0.95, min_samples=20, max_workers=16):
+        self.primary = primary
+        self.backup = backup
+        self.name = primary.name
+        self.model = primary.model
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.latencies = LatencyWindow()
+        self.first_chunk_latencies = LatencyWindow()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-hedge')
+
+    def _timed_primary(self, prompt, usage):
+        start = time.monotonic()
+        result = self.primary.complete(prompt, usage)
+        self.latencies.add(time.monotonic() - start)
+        return result
+
+    def hedge_delay(self, latencies=None):
+        latencies = latencies or self.latencies
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies.percentile(self.percentile)
+
+    def complete(self, prompt, usage=None):
+        delay = self.hedge_delay()
+        primary_usage, backup_usage = {}, {}
+        primary = self._pool.submit(self._timed_primary, prompt, primary_usage)
+        if delay is None:
+            result = primary.result()
+            _copy_usage(usage, primary_usage)
+            return result
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            result = primary.result()
+            _copy_usage(usage, primary_usage)
+            return result
+        logger.info(f"{self.primary.name} exceeded p{int(self.percentile * 100)} ({delay:.1f}s); hedging to {self.backup.name}")
+        backup = self._pool.submit(self.backup.complete, prompt, backup_usage)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    _copy_usage(usage, primary_usage if future is primary else backup_usage)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def stream(self, prompt, usage=None):
+        delay = self.hedge_delay(self.first_chunk_latencies)
+        ready = threading.Event()
+        primary_usage = {}
+        primary = StreamPump(self.primary.stream(prompt, primary_usage), ready)
+        pumps = [(primary, primary_usage)]
+        if delay is None or primary.wait_started(delay):
+            winner = pumps[0]
+        else:
+            logger.info(f"{self.primary.name} gave no output within p{int(self.percentile * 100)} "
+                        f"({delay:.1f}s); hedging stream to {self.backup.name}")
+            backup_usage = {}
+            pumps.append((StreamPump(self.backup.stream(prompt, backup_usage), ready), backup_usage))
+            winner = None
+            while winner is None:
+                ready.wait()
+                ready.clear()
+                started = [(pump, pump_usage) for pump, pump_usage in pumps if pump.wait_started(0)]
+                succeeded = [item for item in started if not item[0].failed]
+                if succeeded:
+                    winner = succeeded[0]
+                elif len(started) == len(pumps):
+                    # Both failed before any output; surface the primary's error
+                    winner = pumps[0]
+        # Time to the primary's first chunk, or a lower bound on it if the backup won
+        first_chunk_at = primary.first_chunk_at if winner[0] is primary else None
+        self.first_chunk_latencies.add((first_chunk_at or time.monotonic()) - primary.started_at)
+        for pump, _ in pumps:
+            if pump is not winner[0]:
+                pump.cancel()
+        try:
+            yield from winner[0]
+        finally:
+            _copy_usage(usage, winner[1])
+
+
+def _copy_usage(usage, source):
+    if usage is not None:
+        usage.update(source)
+
+
+def build_provider():
+    """Build the configured provider from environment variables.
+
+    LLM_PROVIDER selects ``openrouter`` (default) or ``stub``. When
+    LLM_BACKUP_MODEL is set, calls are hedged to that model.
+    """
+    kind = os.environ.get("LLM_PROVIDER", "openrouter").lower()
+    if kind == 'stub':
+        return StubProvider(latency=float(os.environ.get("LLM_STUB_LATENCY", 0)))
+
+    def openrouter(model):
+        return OpenAIProvider(
+            name=f"openrouter:{model}",
+            base_url=os.environ.get("LLM_BASE_URL", "https://openrouter.ai/api/v1"),
+            api_key=os.environ.get("aiAPI"),
+            model=model,
+            timeout=float(os.environ.get("LLM_TIMEOUT", 60)),
+            connect_timeout=float(os.environ.get("LLM_CONNECT_TIMEOUT", 5)),
+            max_retries=int(os.environ.get("LLM_MAX_RETRIES", 2)),
+            pool_size=int(os.environ.get("LLM_POOL_SIZE", 20)),
+            extra_headers={
+                "HTTP-Referer": "<YOUR_SITE_URL>",  # Optional. Site URL for rankings on openrouter.ai.
+                "X-Title": "<YOUR_SITE_NAME>",  # Optional. Site title for rankings on openrouter.ai.
+            },
+        )
+
+    primary = openrouter(os.environ.get("LLM_MODEL", "arcee-ai/trinity-large-preview:free"))
+    backup_model = os.environ.get("LLM_BACKUP_MODEL")
+    if not backup_model:
+        return primary
+    return HedgedProvider(
+        primary,
+        openrouter(backup_model),
+        percentile=float(os.environ.get("LLM_HEDGE_PERCENTILE", 0.95)),
+        min_samples=int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", 20)),
+    )
@@ -0,0 +1,123 @@
+import threading
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, list(counts), total, count)
+                           for key, (counts, total, count) in self._values.items())
+        for key, counts, total, count in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", bound))} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", "+Inf"))} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+LLM_REQUESTS = registry.counter(
+    'llm_requests_total', 'Lesson generation requests by outcome (success, timeout, error, cache_hit).',
+    ('model', 'outcome', 'language', 'grade'))
+LLM_DURATION = registry.histogram(
+    'llm_request_duration_seconds', 'Wall time of lesson generation requests.', ('model', 'outcome'))
+LLM_TTFT = registry.histogram(
+    'llm_time_to_first_token_seconds', 'Time until the first streamed chunk arrives.', ('model',))
+LLM_PROMPT_TOKENS = registry.counter(
+    'llm_prompt_tokens_total', 'Prompt tokens reported by the provider.', ('model',))
+LLM_COMPLETION_TOKENS = registry.counter(
+    'llm_completion_tokens_total', 'Completion tokens reported by the provider.', ('model',))
+
+
+def record_llm_call(model, outcome, language, grade, duration, ttft=None, usage=None):
+    """Record one generation request in the LLM metrics."""
+    LLM_REQUESTS.inc(model=model, outcome=outcome, language=language, grade=grade)
+    LLM_DURATION.observe(duration, model=model, outcome=outcome)
+    if ttft is not None:
+        LLM_TTFT.observe(ttft, model=model)
+    if usage:
+        LLM_PROMPT_TOKENS.inc(usage.get('prompt_tokens') or 0, model=model)
+        LLM_COMPLETION_TOKENS.inc(usage.get('completion_tokens') or 0, model=model)
@@ -1,8 +1,47 @@
 # models.py
+import base64
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from types import MappingProxyType
 from flask import current_app
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timezone
+from topic_index import topic_index
+from lesson_search import lesson_search
+from ttl_cache import TTLCache
+from txn_buffer import transaction_buffer
+
+# Short-lived cache of users rows, so authenticated requests don't each
+# need a database round trip. Every write to a user invalidates its entry.
+user_cache = TTLCache(
+    ttl=int(os.environ.get("USER_CACHE_TTL", 30)),
+    max_entries=int(os.environ.get("USER_CACHE_MAX_ENTRIES", 10000))
+)
+
+# Per-user lesson aggregates for the dashboard. Changes only invalidate this
+# process's entry, so the TTL is kept to a few seconds: other workers may show
+# stale totals for at most that long. It only absorbs dashboard reloads; the
+# lesson_stats RPC behind it is a single cheap query.
+lesson_stats_cache = TTLCache(
+    ttl=int(os.environ.get("LESSON_STATS_TTL", 5)),
+    max_entries=int(os.environ.get("LESSON_STATS_MAX_ENTRIES", 10000))
+)
+
+def month_start():
+    now = datetime.now(timezone.utc)
+    return datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+
+# Columns of the admin user directory and its CSV export
+USER_DIRECTORY_COLUMNS = 'id,name,email,role,monthly_token_quota,token_balance,date_created'
+USER_SORT_COLUMNS = ('name', 'email', 'role', 'token_balance', 'date_created')
+# Characters that would break out of a PostgREST or() filter or act as LIKE wildcards;
+# underscores are common in emails, so they are escaped instead
+DIRECTORY_SEARCH_STRIP = re.compile(r'[,()*%\\"]')
 
 class User(UserMixin):
     def __init__(self, user_data):
@@ -19,9 +58,15 @@ class User(UserMixin):
     @staticmethod
     def get_by_id(user_id):
         try:
-            supabase = current_app.config["SUPABASE_CLIENT"]
-            response = supabase.table('users').select("*").eq('id', user_id).single().execute()
-            user = User(response.data) if response.data else None
+            row = user_cache.get(str(user_id))
+            if row is None:
+                supabase = current_app.config["SUPABASE_CLIENT"]
+                response = supabase.table('users').select("*").eq('id', user_id).single().execute()
+                row = response.data
+                if row:
+                    user_cache.set(str(user_id), row)
+            # Accounts marked for deletion are gone as far as the app is concerned
+            user = User(dict(row)) if row and not row.get('deleted_at') else None
             if user:
                 user.ensure_monthly_renewal()
             return user
@@ -33,7 +78,8 @@ class User(UserMixin):
     def get_by_email(email):
         try:
             supabase = current_app.config["SUPABASE_CLIENT"]
-            response = supabase.table('users').select("*").eq('email', email).execute()
+            response = supabase.table('users').select("*").eq('email', email) \
+                .is_('deleted_at', 'null').execute()
             if response.data and len(response.data) > 0:
                 user = User(response.data[0])
                 user.ensure_monthly_renewal()
@@ -69,6 +115,104 @@ class User(UserMixin):
             print(f"Error creating user: {e}")
             return None
     
+    @staticmethod
+    def invalidate_cache(user_id):
+        user_cache.invalidate(str(user_id))
+
+    @staticmethod
+    def mark_deleted(user_id):
+        """Disable an account at once; its rows are removed later by ``purge``.
+
+        The email is replaced at once, so the address can be registered again
+        before (or without) the purge.
+        """
+        supabase = current_app.config["SUPABASE_CLIENT"]
+        supabase.table('users').update({
+            'deleted_at': datetime.now(timezone.utc).isoformat(),
+            'email': f"deleted+{user_id}@deleted.invalid"
+        }).eq('id', user_id).execute()
+        User.invalidate_cache(user_id)
+        lesson_search.remove_user(user_id)
+        # Other workers' topic indexes still list these lessons; find_similar_lesson re-checks reusable
+        response = supabase.table('lessons').update({'reusable': False}).eq('user_id', user_id).execute()
+        for row in response.data or []:
+            topic_index.remove(row['id'])
+        Lesson.invalidate_stats(user_id)
+
+    @staticmethod
+    def purge(user_id, progress=None):
+        """Delete an account with its lessons, presentations, files and ledger rows, in chunks."""
+        supabase = current_app.config["SUPABASE_CLIENT"]
+        chunk_size = current_app.config.get('PURGE_CHUNK_SIZE', 200)
+        counts = {'lessons': 0, 'presentations': 0, 'files': 0, 'token_transactions': 0}
+
+        def report(chunk_counts):
+            if progress:
+                progress({**counts, **{k: counts[k] + v for k, v in chunk_counts.items()}})
+
+        while True:
+            rows = supabase.table('lessons').select('id').eq('user_id', user_id) \
+                .order('id').limit(chunk_size).execute().data or []
+            if not rows:
+                break
+            chunk_counts = Lesson.purge_many([row['id'] for row in rows], progress=report)
+            for key, value in chunk_counts.items():
+                counts[key] += value
+        # Buffered ledger rows for this user must land before their rows are deleted
+        transaction_buffer.flush()
+        while True:
+            rows = supabase.table('token_transactions').select('id').eq('user_id', user_id) \
+                .order('id').limit(chunk_size).execute().data or []
+            if not rows:
+                break
+            supabase.table('token_transactions').delete().in_('id', [row['id'] for row in rows]).execute()
+            counts['token_transactions'] += len(rows)
+            report({})
+        supabase.table('users').delete().eq('id', user_id).execute()
+        User.invalidate_cache(user_id)
+        Lesson.invalidate_stats(user_id)
+        return counts
+
+    @staticmethod
+    def _directory_query(columns, search=None, role=None, max_balance=None, count=None):
+        supabase = current_app.config["SUPABASE_CLIENT"]
+        query = supabase.table('users').select(columns, count=count).is_('deleted_at', 'null')
+        search = DIRECTORY_SEARCH_STRIP.sub('', search or '').strip().replace('_', '\\_')
+        if search:
+            query = query.or_(f'name.ilike.{search}*,email.ilike.{search}*')
+        if role:
+            query = query.eq('role', role)
+        if max_balance is not None:
+            query = query.lte('token_balance', max_balance)
+        return query
+
+    @staticmethod
+    def directory(search=None, role=None, max_balance=None, sort='name', desc=False, limit=50, offset=0):
+        """One page of the admin user directory and the number of matching users.
+
+        ``search`` matches the start of the name or email, ``max_balance``
+        keeps users whose balance is at or below it. Returns ``(rows, total)``.
+        """
+        if sort not in USER_SORT_COLUMNS:
+            sort = 'name'
+        response = User._directory_query(USER_DIRECTORY_COLUMNS, search, role, max_balance, count='exact') \
+            .order(sort, desc=desc).order('id', desc=desc).range(offset, offset + limit - 1).execute()
+        return response.data or [], response.count or 0
+
+    @staticmethod
+    def iter_directory(search=None, role=None, max_balance=None, chunk_size=1000):
+        """Yield every matching user row, fetched ``chunk_size`` rows at a time in id order."""
+        last_id = None
+        while True:
+            query = User._directory_query(USER_DIRECTORY_COLUMNS, search, role, max_balance)
+            if last_id is not None:
+                query = query.gt('id', last_id)
+            rows = query.order('id').limit(chunk_size).execute().data or []
+            yield from rows
+            if len(rows) < chunk_size:
+                break
+            last_id = rows[-1]['id']
+
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
@@ -87,6 +231,7 @@ class User(UserMixin):
             
             if update_data:
                 response = supabase.table('users').update(update_data).eq('id', self.id).execute()
+                User.invalidate_cache(self.id)
                 return response.data[0] if response.data else None
             return None
         except Exception as e:
@@ -97,50 +242,80 @@ class User(UserMixin):
         return (self.role or '').lower() == 'admin'
 
     def _month_start(self):
-        now = datetime.now(timezone.utc)
-        return datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+        return month_start()
+
+    def renewal_due(self):
+        """True if the balance was last renewed before the current month (in-memory check only)."""
+        renew = self.token_renewal_date
+        if not isinstance(renew, str) or not renew:
+            return False
+        try:
+            renew_dt = datetime.fromisoformat(renew.replace('Z', '+00:00'))
+        except Exception:
+            return False
+        return renew_dt < self._month_start()
 
     def ensure_monthly_renewal(self):
+        """Renew a due user inline.
+
+        Normally the scheduled ``flask renew-tokens`` job has already renewed
+        everyone, so this is just a date comparison. Set RENEWAL_INLINE=0 to
+        leave stragglers to the job entirely.
+
+        The row may come from this worker's cache after another worker or the
+        renewal job has already renewed it, so a due user is re-read, and the
+        update only applies while the renewal date and balance are still the
+        ones read. A renewal is therefore applied and logged once.
+        """
+        if not self.renewal_due() or not current_app.config.get('RENEWAL_INLINE', True):
+            return
         try:
             supabase = current_app.config["SUPABASE_CLIENT"]
+            row = supabase.table('users').select("*").eq('id', self.id).single().execute().data
+            if not row:
+                return
+            user_cache.set(str(self.id), row)
+            self.role = row.get('role')
+            self.monthly_token_quota = row.get('monthly_token_quota')
+            self.token_balance = row.get('token_balance')
+            self.token_renewal_date = row.get('token_renewal_date')
+            if not self.renewal_due():
+                return
             quota = self.monthly_token_quota or RoleConfig.get_quota_for_role(self.role or 'student')
-            renew = self.token_renewal_date
-            renew_dt = None
-            if isinstance(renew, str) and renew:
-                try:
-                    renew_dt = datetime.fromisoformat(renew.replace('Z', '+00:00'))
-                except Exception:
-                    renew_dt = None
-            if not renew_dt:
-                renew_dt = self._month_start()
-            if renew_dt < self._month_start():
-                prev_balance = self.token_balance or 0
-                self.token_balance = quota
-                self.monthly_token_quota = quota
-                self.token_renewal_date = datetime.now(timezone.utc).isoformat()
-                supabase.table('users').update({
-                    'token_balance': self.token_balance,
-                    'monthly_token_quota': self.monthly_token_quota,
-                    'token_renewal_date': self.token_renewal_date
-                }).eq('id', self.id).execute()
-                change = (self.token_balance or 0) - (prev_balance or 0)
-                if change != 0:
-                    TokenTransaction.create(self.id, change, 'monthly_renewal', 'system', None)
+            prev_balance = self.token_balance
+            renewal_date = datetime.now(timezone.utc).isoformat()
+            query = supabase.table('users').update({
+                'token_balance': quota,
+                'monthly_token_quota': quota,
+                'token_renewal_date': renewal_date
+            }).eq('id', self.id).eq('token_renewal_date', self.token_renewal_date)
+            query = query.is_('token_balance', 'null') if prev_balance is None else query.eq('token_balance', prev_balance)
+            response = query.execute()
+            User.invalidate_cache(self.id)
+            if not response.data:
+                # Renewed or spent from elsewhere meanwhile; the next request sees the new row
+                return
+            self.token_balance = quota
+            self.monthly_token_quota = quota
+            self.token_renewal_date = renewal_date
+            change = quota - (prev_balance or 0)
+            if change != 0:
+                TokenTransaction.create(self.id, change, 'monthly_renewal', 'system', None)
         except Exception as e:
             print(f"Error in monthly renewal: {e}")
 
     def deduct_tokens(self, amount, reason, source=None):
+        """Atomically take ``amount`` tokens if the stored balance allows it."""
         try:
-            supabase = current_app.config["SUPABASE_CLIENT"]
-            balance = self.token_balance or 0
             if amount <= 0:
                 return False
-            if balance < amount:
+            new_balance = current_app.config["LEDGER"].apply(self.id, -amount, reason, source or 'app')
+            if new_balance is None:
                 return False
-            new_balance = balance - amount
             self.token_balance = new_balance
-            supabase.table('users').update({'token_balance': new_balance}).eq('id', self.id).execute()
-            TokenTransaction.create(self.id, -amount, reason, source or 'app', None)
+            User.invalidate_cache(self.id)
+            # The dashboard's tokens_used_this_month includes this spend
+            Lesson.invalidate_stats(self.id)
             return True
         except Exception as e:
             print(f"Error deducting tokens: {e}")
@@ -148,20 +323,45 @@ class User(UserMixin):
 
     def add_tokens(self, amount, reason, source=None):
         try:
-            supabase = current_app.config["SUPABASE_CLIENT"]
-            balance = self.token_balance or 0
             if amount <= 0:
                 return False
-            new_balance = balance + amount
+            new_balance = current_app.config["LEDGER"].apply(self.id, amount, reason, source or 'app')
+            if new_balance is None:
+                return False
             self.token_balance = new_balance
-            supabase.table('users').update({'token_balance': new_balance}).eq('id', self.id).execute()
-            TokenTransaction.create(self.id, amount, reason, source or 'app', None)
+            User.invalidate_cache(self.id)
             return True
         except Exception as e:
             print(f"Error adding tokens: {e}")
             return False
 
+# Lesson columns for listings; the plan text columns are fetched only when a lesson is opened
+LESSON_SUMMARY_COLUMNS = 'id, user_id, grade_level, topic, teaching_strategy, language, date_created, date_modified'
+
+
+def encode_cursor(date_created, lesson_id):
+    return base64.urlsafe_b64encode(json.dumps([date_created, lesson_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Inverse of ``encode_cursor``; None for a missing or malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        created, lesson_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        lesson_id = int(lesson_id)
+    except (ValueError, TypeError):
+        return None
+    # The timestamp is spliced into a PostgREST filter, so accept only timestamp characters
+    if not isinstance(created, str) or not re.fullmatch(r'[0-9T:.+\- Z]+', created):
+        return None
+    return created, lesson_id
+
+
 class Lesson:
+    # Version of lessons saved before date_modified was set on every write
+    UNVERSIONED = 'unversioned'
+
     def __init__(self, lesson_data):
         self.id = lesson_data.get('id')
         self.user_id = lesson_data.get('user_id')
@@ -173,9 +373,11 @@ class Lesson:
         self.gpt_plan = lesson_data.get('gpt_plan')
         self.date_created = lesson_data.get('date_created')
         self.date_modified = lesson_data.get('date_modified')
+        # False for drafts and hand-edited plans, which are never offered to other teachers
+        self.reusable = lesson_data.get('reusable', True)
     
     @staticmethod
-    def create(user_id, grade_level, topic, teaching_strategy, language, generated_plan=None, gpt_plan=None):
+    def create(user_id, grade_level, topic, teaching_strategy, language, generated_plan=None, gpt_plan=None, reusable=True):
         try:
             supabase = current_app.config["SUPABASE_CLIENT"]
             response = supabase.table('lessons').insert({
@@ -185,28 +387,133 @@ class Lesson:
                 'teaching_strategy': teaching_strategy,
                 'language': language,
                 'generated_plan': generated_plan,
-                'gpt_plan': gpt_plan
+                'gpt_plan': gpt_plan,
+                'reusable': reusable
             }).execute()
-            return Lesson(response.data[0]) if response.data else None
+            lesson = Lesson(response.data[0]) if response.data else None
+            Lesson.invalidate_stats(user_id)
+            if lesson:
+                lesson_search.add(lesson)
+            if lesson and lesson.generated_plan and reusable:
+                lesson.index_topic()
+            return lesson
         except Exception as e:
             print(f"Error creating lesson: {e}")
             return None
     
+    @staticmethod
+    def create_many(rows):
+        """Insert several lessons in one request; ``rows`` are dicts of lesson columns."""
+        try:
+            supabase = current_app.config["SUPABASE_CLIENT"]
+            response = supabase.table('lessons').insert(rows).execute()
+            lessons = [Lesson(item) for item in response.data or []]
+            for user_id in {row.get('user_id') for row in rows}:
+                Lesson.invalidate_stats(user_id)
+            for lesson in lessons:
+                lesson_search.add(lesson)
+                if lesson.generated_plan and lesson.reusable:
+                    lesson.index_topic()
+            return lessons
+        except Exception as e:
+            print(f"Error creating lessons: {e}")
+            return []
+
     @staticmethod
     def get_all_by_user(user_id):
+        """Every lesson of the user, newest first, without the plan text columns."""
         try:
             supabase = current_app.config["SUPABASE_CLIENT"]
-            response = supabase.table('lessons').select("*").eq('user_id', user_id).order('date_created', desc=True).execute()
+            response = supabase.table('lessons').select(LESSON_SUMMARY_COLUMNS).eq('user_id', user_id) \
+                .is_('deleted_at', 'null').order('date_created', desc=True).order('id', desc=True).execute()
             return [Lesson(item) for item in response.data]
         except Exception as e:
             print(f"Error getting lessons: {e}")
             return []
+
+    @staticmethod
+    def count_by_user(user_id):
+        """Exact number of lessons the user has, without fetching any rows."""
+        try:
+            supabase = current_app.config["SUPABASE_CLIENT"]
+            response = supabase.table('lessons').select('id', count='exact').eq('user_id', user_id) \
+                .is_('deleted_at', 'null').limit(1).execute()
+            return response.count or 0
+        except Exception as e:
+            print(f"Error counting lessons: {e}")
+            return 0
+
+    @staticmethod
+    def stats_for_user(user_id):
+        """Presentation count, lessons by strategy and by grade, and tokens spent this month; cached per user for LESSON_STATS_TTL seconds."""
+        stats = lesson_stats_cache.get(str(user_id))
+        if stats is not None:
+            return stats
+        try:
+            supabase = current_app.config["SUPABASE_CLIENT"]
+            # Aggregated in the database (sql/lesson_stats.sql); only the totals come back
+            stats = supabase.rpc('lesson_stats', {
+                'p_user_id': user_id,
+                'p_since': month_start().isoformat()
+            }).execute().data
+            lesson_stats_cache.set(str(user_id), stats)
+            return stats
+        except Exception as e:
+            print(f"Error computing lesson stats: {e}")
+            return {'presentations': 0, 'by_strategy': {}, 'by_grade': {}, 'tokens_used_this_month': 0}
+
+    @staticmethod
+    def invalidate_stats(user_id):
+        lesson_stats_cache.invalidate(str(user_id))
+
+    @staticmethod
+    def get_version(lesson_id):
+        """Just ``id``, ``user_id`` and ``date_modified`` of a lesson, for conditional requests."""
+        try:
+            supabase = current_app.config["SUPABASE_CLIENT"]
+            response = supabase.table('lessons').select('id,user_id,date_modified').eq('id', lesson_id) \
+                .is_('deleted_at', 'null').limit(1).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            print(f"Error getting lesson version: {e}")
+            return None
+
+    @staticmethod
+    def get_page_by_user(user_id, limit=24, cursor=None):
+        """One page of the user's lessons, newest first, without the plan text columns.
+
+        Pages are keyed on ``(date_created, id)`` rather than an offset, so each
+        page is an index range scan and rows inserted meanwhile don't shift
+        later pages. Returns ``(lessons, next_cursor)``; ``next_cursor`` is
+        None on the last page.
+        """
+        try:
+            supabase = current_app.config["SUPABASE_CLIENT"]
+            query = supabase.table('lessons').select(LESSON_SUMMARY_COLUMNS).eq('user_id', user_id) \
+                .is_('deleted_at', 'null')
+            after = decode_cursor(cursor)
+            if after:
+                created, lesson_id = after
+                query = query.or_(f'date_created.lt."{created}",'
+                                  f'and(date_created.eq."{created}",id.lt.{lesson_id})')
+            response = query.order('date_created', desc=True).order('id', desc=True).limit(limit + 1).execute()
+            rows = response.data or []
+            lessons = [Lesson(item) for item in rows[:limit]]
+            next_cursor = None
+            if len(rows) > limit:
+                last = lessons[-1]
+                next_cursor = encode_cursor(last.date_created, last.id)
+            return lessons, next_cursor
+        except Exception as e:
+            print(f"Error getting lessons page: {e}")
+            return [], None
     
     @staticmethod
     def get_by_id(lesson_id):
         try:
             supabase = current_app.config["SUPABASE_CLIENT"]
-            response = supabase.table('lessons').select("*").eq('id', lesson_id).single().execute()
+            response = supabase.table('lessons').select("*").eq('id', lesson_id) \
+                .is_('deleted_at', 'null').single().execute()
             return Lesson(response.data) if response.data else None
         except Exception as e:
             print(f"Error getting lesson: {e}")
@@ -225,13 +532,105 @@ class Lesson:
                     update_data[key] = value
             
             if update_data:
+                # date_modified drives the lesson ETags, so every write moves it
+                if 'date_modified' not in update_data:
+                    self.date_modified = update_data['date_modified'] = datetime.now(timezone.utc).isoformat()
                 response = supabase.table('lessons').update(update_data).eq('id', self.id).execute()
+                # Skip partially loaded (summary) lessons, which would index an empty body
+                if ('topic' in update_data or 'generated_plan' in update_data) and self.generated_plan is not None:
+                    lesson_search.add(self)
                 return response.data[0] if response.data else None
             return None
         except Exception as e:
             print(f"Error updating lesson: {e}")
             return None
     
+    @staticmethod
+    def patch(lesson_id, user_id, changes, expected_version=None):
+        """Apply ``changes`` to the user's lesson in one round trip and return ``(lesson, error)``.
+
+        The update is filtered on the owner and, when ``expected_version`` is
+        given, on ``date_modified`` (null for ``Lesson.UNVERSIONED``), so a
+        save based on a stale copy matches no row. Only then is the lesson's version read, to tell ``'not_found'``,
+        ``'forbidden'`` and ``'conflict'`` apart.
+        """
+        supabase = current_app.config["SUPABASE_CLIENT"]
+        update_data = dict(changes, date_modified=datetime.now(timezone.utc).isoformat())
+        if 'generated_plan' in changes or 'gpt_plan' in changes:
+            # Hand-edited plans stay with their author
+            update_data['reusable'] = False
+        query = supabase.table('lessons').update(update_data).eq('id', lesson_id).eq('user_id', user_id) \
+            .is_('deleted_at', 'null')
+        if expected_version == Lesson.UNVERSIONED:
+            query = query.is_('date_modified', 'null')
+        elif expected_version is not None:
+            query = query.eq('date_modified', expected_version)
+        response = query.execute()
+        if response.data:
+            lesson = Lesson(response.data[0])
+            if 'topic' in changes or 'generated_plan' in changes:
+                lesson_search.add(lesson)
+            return lesson, None
+        version = Lesson.get_version(lesson_id)
+        if not version:
+            return None, 'not_found'
+        if version['user_id'] != user_id:
+            return None, 'forbidden'
+        return None, 'conflict'
+
+    def index_topic(self):
+        """Make this lesson's plan available for reuse by near-identical topics."""
+        topic_index.add(self.id, self.topic, self.grade_level, self.teaching_strategy, self.language)
+
+    def delete(self):
+        try:
+            Lesson.purge_many([self.id])
+            Lesson.invalidate_stats(self.user_id)
+            return True
+        except Exception as e:
+            print(f"Error deleting lesson: {e}")
+            return False
+
+    @staticmethod
+    def mark_deleted(lesson_id, user_id):
+        """Hide a lesson at once; the rows are removed later by ``purge_many``."""
+        supabase = current_app.config["SUPABASE_CLIENT"]
+        supabase.table('lessons').update({'deleted_at': datetime.now(timezone.utc).isoformat(), 'reusable': False}) \
+            .eq('id', lesson_id).execute()
+        topic_index.remove(lesson_id)
+        lesson_search.remove(lesson_id)
+        Lesson.invalidate_stats(user_id)
+
+    @staticmethod
+    def purge_many(lesson_ids, progress=None):
+        """Delete lessons with their presentations and presentation files, ``PURGE_CHUNK_SIZE`` at a time.
+
+        Returns counts of deleted lessons, presentation rows and files;
+        ``progress`` is called with the running counts after each chunk.
+        """
+        supabase = current_app.config["SUPABASE_CLIENT"]
+        chunk_size = current_app.config.get('PURGE_CHUNK_SIZE', 200)
+        counts = {'lessons': 0, 'presentations': 0, 'files': 0}
+        lesson_ids = list(lesson_ids)
+        for i in range(0, len(lesson_ids), chunk_size):
+            chunk = lesson_ids[i:i + chunk_size]
+            presentations = supabase.table('presentations').select('id,file_path') \
+                .in_('lesson_id', chunk).execute().data or []
+            for presentation in presentations:
+                if Presentation.remove_file(presentation.get('file_path')):
+                    counts['files'] += 1
+            if presentations:
+                supabase.table('presentations').delete().in_('lesson_id', chunk).execute()
+            supabase.table('lessons').delete().in_('id', chunk).execute()
+            for lesson_id in chunk:
+                topic_index.remove(lesson_id)
+                lesson_search.remove(lesson_id)
+            counts['presentations'] += len(presentations)
+            counts['lessons'] += len(chunk)
+            if progress:
+                progress(counts)
+        return counts
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -246,6 +645,12 @@ class Lesson:
             'date_modified': self.date_modified
         }
 
+    def to_summary_dict(self):
+        """``to_dict`` without the plan text, for listings."""
+        data = self.to_dict()
+        del data['generated_plan'], data['gpt_plan']
+        return data
+
 class Presentation:
     def __init__(self, presentation_data):
         self.id = presentation_data.get('id')
@@ -276,6 +681,20 @@ class Presentation:
             print(f"Error getting presentations: {e}")
             return []
     
+    @staticmethod
+    def remove_file(file_path):
+        """Delete a generated presentation file; only files in the temp directory are touched."""
+        if not file_path:
+            return False
+        path = os.path.realpath(file_path)
+        if os.path.commonpath([path, os.path.realpath(tempfile.gettempdir())]) != os.path.realpath(tempfile.gettempdir()):
+            return False
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -285,15 +704,50 @@ class Presentation:
         }
 
 class RoleConfig:
+    """Monthly quota per role, served from an immutable in-memory snapshot.
+
+    The role_configs table is tiny and rarely changes, so it is loaded once
+    (at startup, or on first use) and reloaded after admin edits. With
+    ROLE_CONFIG_TTL set, the snapshot is also refreshed periodically so
+    other worker processes pick up edits.
+    """
+    _quotas = None
+    _loaded_at = 0.0
+    _lock = threading.Lock()
+
     @staticmethod
-    def get_quota_for_role(role):
+    def load(supabase=None):
         try:
-            supabase = current_app.config["SUPABASE_CLIENT"]
-            r = supabase.table('role_configs').select("monthly_quota").eq('role', role).single().execute()
-            if r.data and 'monthly_quota' in r.data:
-                return int(r.data['monthly_quota'])
-        except Exception:
-            pass
+            supabase = supabase or current_app.config["SUPABASE_CLIENT"]
+            r = supabase.table('role_configs').select("role,monthly_quota").execute()
+            quotas = {row['role']: int(row['monthly_quota']) for row in r.data or []
+                      if row.get('monthly_quota') is not None}
+        except Exception as e:
+            print(f"Error loading role configs: {e}")
+            return RoleConfig._quotas or MappingProxyType({})
+        with RoleConfig._lock:
+            RoleConfig._quotas = MappingProxyType(quotas)
+            RoleConfig._loaded_at = time.monotonic()
+        return RoleConfig._quotas
+
+    @staticmethod
+    def invalidate():
+        with RoleConfig._lock:
+            RoleConfig._quotas = None
+
+    @staticmethod
+    def quotas():
+        quotas = RoleConfig._quotas
+        ttl = int(os.environ.get("ROLE_CONFIG_TTL", 0))
+        if quotas is None or (ttl and time.monotonic() - RoleConfig._loaded_at > ttl):
+            quotas = RoleConfig.load()
+        return quotas
+
+    @staticmethod
+    def get_quota_for_role(role):
+        quota = RoleConfig.quotas().get(role)
+        if quota is not None:
+            return quota
         role_lower = (role or '').lower()
         if role_lower == 'trainer' or role_lower == 'مدرب':
             return 50
@@ -313,16 +767,33 @@ class TokenTransaction:
 
     @staticmethod
     def create(user_id, change, reason, source, meta):
+        """Log a token movement; written behind by the transaction buffer when it is running."""
         try:
-            supabase = current_app.config["SUPABASE_CLIENT"]
-            supabase.table('token_transactions').insert({
+            row = {
                 'user_id': user_id,
                 'change': change,
                 'reason': reason,
                 'source': source,
-                'meta': meta
-            }).execute()
+                'meta': meta,
+                'date_created': datetime.now(timezone.utc).isoformat()
+            }
+            if transaction_buffer.running:
+                transaction_buffer.put(row)
+                return True
+            supabase = current_app.config["SUPABASE_CLIENT"]
+            supabase.table('token_transactions').insert(row).execute()
             return True
         except Exception as e:
             print(f"Error creating token transaction: {e}")
             return False
+
+    @staticmethod
+    def create_many(rows):
+        """Insert several ledger rows (dicts with user_id, change, reason, source, meta) in one request."""
+        try:
+            supabase = current_app.config["SUPABASE_CLIENT"]
+            supabase.table('token_transactions').insert(rows).execute()
+            return True
+        except Exception as e:
+            print(f"Error creating token transactions: {e}")
+            return False
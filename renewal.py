@@ -0,0 +1,72 @@
+import logging
+from datetime import datetime, timezone
+
+from models import User, RoleConfig, month_start
+
+logger = logging.getLogger(__name__)
+
+
+def renew_due_users(supabase, ledger_backend, chunk_size=500, dry_run=False):
+    """Reset every user whose balance was last renewed before this month.
+
+    Due users are fetched ``chunk_size`` at a time, and each chunk is renewed
+    with its ``monthly_renewal`` ledger rows in one ``apply_ledger_changes``
+    transaction, guarded on the balances read. A user whose balance changed
+    since the read (a spend, or an inline renewal) is skipped; an inline
+    renewal picks them up on their next request. Returns a summary dict.
+    """
+    cutoff = month_start().isoformat()
+    summary = {'renewed': 0, 'ledger_rows': 0, 'chunks': 0, 'skipped': 0, 'failed': 0}
+    role_quotas = {}
+    last_id = None
+    while True:
+        query = (supabase.table('users')
+                 .select('id,role,monthly_token_quota,token_balance')
+                 .lt('token_renewal_date', cutoff)
+                 .is_('deleted_at', 'null'))
+        # Keyset paging: rows left due by a dry run or a failed update must not be fetched again
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        rows = query.order('id').limit(chunk_size).execute().data or []
+        if not rows:
+            break
+        summary['chunks'] += 1
+        last_id = rows[-1]['id']
+
+        if dry_run:
+            summary['renewed'] += len(rows)
+            if len(rows) < chunk_size:
+                break
+            continue
+
+        now = datetime.now(timezone.utc).isoformat()
+        updates = []
+        for row in rows:
+            quota = row.get('monthly_token_quota')
+            if not quota:
+                role = row.get('role') or 'student'
+                if role not in role_quotas:
+                    role_quotas[role] = RoleConfig.get_quota_for_role(role)
+                quota = role_quotas[role]
+            updates.append({
+                'id': row['id'],
+                'expected_balance': row.get('token_balance'),
+                'token_balance': quota,
+                'monthly_token_quota': quota,
+                'token_renewal_date': now
+            })
+        try:
+            renewed = ledger_backend.apply_many(updates, 'monthly_renewal', 'system')
+        except Exception as e:
+            logger.error(f"Renewal failed for {len(rows)} users: {e}")
+            summary['failed'] += len(rows)
+        else:
+            summary['renewed'] += len(renewed)
+            summary['skipped'] += len(rows) - len(renewed)
+            summary['ledger_rows'] += sum(1 for update in updates if str(update['id']) in renewed
+                                          and update['token_balance'] != (update['expected_balance'] or 0))
+        for row in rows:
+            User.invalidate_cache(row['id'])
+        if len(rows) < chunk_size:
+            break
+    return summary
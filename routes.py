@@ -1,10 +1,24 @@
+import csv
+import hmac
+import io
 import os
+import json
+import time
 import tempfile
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, send_file, session, current_app,abort
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, send_file, session, current_app,abort, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
-from models import User, Lesson, Presentation, RoleConfig, TokenTransaction
+from models import User, Lesson, Presentation, RoleConfig, TokenTransaction, user_cache, lesson_stats_cache
 from forms import LoginForm, RegistrationForm, LessonForm, EditLessonForm, ARLessonForm, UserProfileForm, WhatsAppMessageForm
-from lesson_generator import generate_lesson_plan, gpt_plans
+from lesson_generator import generate_lesson_plan, stream_lesson_plan, generate_fast_draft, fast_draft_available, gpt_plans
+from jobs import job_queue, QueueFull
+from generation_cache import generation_cache
+from topic_index import topic_index
+from lesson_search import lesson_search
+from metrics import registry
+from bulk_admin import BULK_ACTIONS, run_bulk
+from llm_providers import StreamPump
 from docx import Document
 # from ppt_generator import create_presentation
 # from whatsapp_sender import process_excel_file, open_whatsapp_web
@@ -72,8 +86,50 @@ def get_user():
 @routes.route('/api/lessons', methods=['GET'])
 @login_required
 def get_lessons():
-    lessons = Lesson.get_all_by_user(current_user.id)
-    return jsonify([lesson.to_dict() for lesson in lessons])
+    """One page of lesson summaries; the next page's cursor is in the ``X-Next-Cursor`` header."""
+    limit = min(max(request.args.get('limit', current_app.config['LESSON_PAGE_SIZE'], type=int), 1), 100)
+    lessons, next_cursor = Lesson.get_page_by_user(current_user.id, limit, request.args.get('cursor'))
+    response = jsonify([lesson.to_summary_dict() for lesson in lessons])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for("routes.get_lessons", limit=limit, cursor=next_cursor)}>; rel="next"'
+    return conditional(response)
+
+def conditional(response, etag=None, last_modified=None):
+    """Tag a JSON response for revalidation and answer 304 when the client's copy matches.
+
+    Without an explicit ``etag`` the body is hashed. Browsers revalidate on
+    every request (``no-cache``) and reuse their copy on 304, so clients need
+    no changes.
+    """
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    if etag:
+        response.set_etag(etag)
+    else:
+        response.add_etag()
+    if last_modified:
+        response.last_modified = last_modified
+    return response.make_conditional(request)
+
+def lesson_etag(date_modified):
+    """A lesson's ETag is its ``date_modified``, which PATCH takes back as the If-Match version.
+
+    Legacy rows without one share a fixed ETag, which PATCH matches against a null ``date_modified``.
+    """
+    return str(date_modified) if date_modified else Lesson.UNVERSIONED
+
+def parse_flag(value):
+    """JSON booleans, or the strings and numbers form clients send for them ("false" and "0" are false)."""
+    if isinstance(value, str):
+        return value.strip().lower() not in ('', '0', 'false', 'no', 'off')
+    return bool(value)
+
+def parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
 
 @routes.route('/api/lessons', methods=['POST'])
 @login_required
@@ -83,38 +139,332 @@ def create_lesson():
     if not current_user.deduct_tokens(1, 'lesson_create', 'app'):
         return jsonify({'success': False, 'message': 'Insufficient tokens', 'notify': 'نفدت التوكنز المتاحة. الرجاء الترقية أو انتظار التجديد الشهري.'}), 403
 
-    # Generate lesson plan content first
-    try:
-        lesson_plan = generate_lesson_plan(
+    if data.get('mode') == 'fast':
+        lesson = create_draft_lesson(
             data.get('grade_level'),
             data.get('topic'),
             data.get('teaching_strategy'),
-            data.get('language')
+            data.get('language'),
+            'app'
         )
-        gpt_plan = gpt_plans(
-            data.get('grade_level'),
-            data.get('topic'),
-            data.get('teaching_strategy'),
-            data.get('language')
+        if not lesson:
+            return jsonify({'success': False, 'message': 'Failed to create lesson'}), 500
+        return jsonify({'success': True, 'lesson': lesson.to_dict(), 'draft': True})
+
+    job = enqueue_lesson_job(
+        data.get('grade_level'),
+        data.get('topic'),
+        data.get('teaching_strategy'),
+        data.get('language'),
+        'app',
+        force_fresh=parse_flag(data.get('force_fresh', False))
+    )
+    if not job:
+        return jsonify({'success': False, 'message': 'Server is busy, please try again shortly'}), 503
+
+    return jsonify({'success': True, 'job_id': job.id, 'status': job.status}), 202
+
+@routes.route('/api/lessons/batch', methods=['POST'])
+@login_required
+def create_lessons_batch():
+    """Generate a whole term of lessons in one background job.
+
+    Tokens for every topic are reserved in a single ledger entry; topics that
+    fail are refunded together when the job finishes.
+    """
+    data = request.get_json() or {}
+    topics = [str(t).strip() for t in data.get('topics') or [] if str(t).strip()]
+    max_topics = current_app.config.get('BATCH_MAX_TOPICS', 60)
+    if not topics or len(topics) > max_topics:
+        return jsonify({'success': False, 'message': f'Provide between 1 and {max_topics} topics'}), 400
+    max_concurrency = current_app.config.get('BATCH_MAX_CONCURRENCY', 8)
+    try:
+        concurrency = max(1, min(int(data.get('concurrency') or max_concurrency), max_concurrency))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid concurrency'}), 400
+
+    if not current_user.deduct_tokens(len(topics), 'lesson_batch_create', 'app'):
+        return jsonify({'success': False, 'message': 'Insufficient tokens', 'notify': 'نفدت التوكنز المتاحة. الرجاء الترقية أو انتظار التجديد الشهري.'}), 403
+
+    try:
+        job = job_queue.submit(
+            current_user.id, 'lesson_batch', run_lesson_batch_job,
+            current_user.id, data.get('grade_level'), topics, data.get('teaching_strategy'),
+            data.get('language'), concurrency, parse_flag(data.get('force_fresh', False))
         )
+    except QueueFull:
+        current_user.add_tokens(len(topics), 'lesson_batch_refund', 'app')
+        return jsonify({'success': False, 'message': 'Server is busy, please try again shortly'}), 503
+
+    return jsonify({'success': True, 'job_id': job.id, 'status': job.status}), 202
+
+def run_lesson_batch_job(job, user_id, grade_level, topics, teaching_strategy, language, concurrency, force_fresh):
+    """Background task: generate ``topics`` concurrently, then bulk-insert the lessons."""
+    app = current_app._get_current_object()
+    items = [{'topic': topic, 'status': 'queued', 'lesson_id': None, 'error': None} for topic in topics]
+    job.result = {'total': len(topics), 'completed': 0, 'failed': 0, 'items': items}
+    plans = {}
+
+    def generate(index):
+        topic = topics[index]
+        items[index]['status'] = 'running'
+        try:
+            with app.app_context():
+                reused = None if force_fresh else find_similar_lesson(grade_level, topic, teaching_strategy, language)
+                plans[index] = reused.generated_plan if reused else generate_lesson_plan(
+                    grade_level, topic, teaching_strategy, language, force_fresh=force_fresh)
+            items[index]['status'] = 'generated'
+        except Exception as e:
+            items[index]['error'] = str(e)
+            if fast_draft_available(language):
+                items[index]['draft'] = True
+                plans[index] = generate_fast_draft(grade_level, topic, teaching_strategy, language)
+                items[index]['status'] = 'generated'
+            else:
+                # No draft in the requested language; the topic is refunded below
+                items[index]['status'] = 'failed'
+        job.notify()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='lesson-batch') as pool:
+        list(pool.map(generate, range(len(topics))))
+
+    generated = sorted(plans)
+    rows = [{
+        'user_id': user_id,
+        'grade_level': grade_level,
+        'topic': topics[i],
+        'teaching_strategy': teaching_strategy,
+        'language': language,
+        'generated_plan': plans[i],
+        'gpt_plan': gpt_plans(grade_level, topics[i], teaching_strategy, language),
+        'reusable': not items[i].get('draft')
+    } for i in generated]
+    lessons = Lesson.create_many(rows) if rows else []
+    if len(lessons) == len(generated):
+        for i, lesson in zip(generated, lessons):
+            items[i]['status'] = 'done'
+            items[i]['lesson_id'] = lesson.id
+        job.result['completed'] = len(lessons)
+    else:
+        for i in generated:
+            items[i]['status'] = 'failed'
+            items[i]['error'] = 'Failed to save lesson'
+    job.result['failed'] = sum(1 for item in items if item['status'] == 'failed')
+
+    if job.result['failed']:
+        user = User.get_by_id(user_id)
+        if user:
+            user.add_tokens(job.result['failed'], 'lesson_batch_refund', 'app')
+    return job.result
+
+@routes.route('/api/lessons/search', methods=['GET'])
+@login_required
+def search_lessons():
+    """Ranked full-text search over the current user's lesson topics and plans."""
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'success': False, 'message': 'Query is required'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 50)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    try:
+        results = lesson_search.search(current_user.id, query, limit=limit, offset=offset)
     except Exception as e:
-        return jsonify({'success': False, 'message': f'Error generating lesson plan: {str(e)}'}), 500
+        current_app.logger.error(f"Lesson search failed: {e}")
+        return jsonify({'success': False, 'message': 'Search is unavailable'}), 503
+    return jsonify({'success': True, 'query': query, 'results': results})
 
-    # Create new lesson using Supabase
+@routes.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if not job or (str(job.user_id) != str(current_user.id) and not current_user.is_admin()):
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+def enqueue_lesson_job(grade_level, topic, teaching_strategy, language, source, force_fresh=False):
+    """Queue lesson generation for the current user, who has already been charged.
+
+    Returns the Job, or None (after refunding the token) when the queue is full.
+    """
+    try:
+        return job_queue.submit(
+            current_user.id, 'lesson_create', run_lesson_job,
+            current_user.id, grade_level, topic, teaching_strategy, language, source,
+            force_fresh=force_fresh
+        )
+    except QueueFull:
+        current_user.add_tokens(1, 'lesson_refund', source)
+        return None
+
+def create_draft_lesson(grade_level, topic, teaching_strategy, language, source):
+    """Create a lesson straight from the local templates (no LLM call); refunds on failure."""
     lesson = Lesson.create(
         user_id=current_user.id,
-        grade_level=data.get('grade_level'),
-        topic=data.get('topic'),
-        teaching_strategy=data.get('teaching_strategy'),
-        language=data.get('language'),
-        generated_plan=lesson_plan,
-        gpt_plan=gpt_plan
+        grade_level=grade_level,
+        topic=topic,
+        teaching_strategy=teaching_strategy,
+        language=language,
+        generated_plan=generate_fast_draft(grade_level, topic, teaching_strategy, language),
+        gpt_plan=gpt_plans(grade_level, topic, teaching_strategy, language),
+        reusable=False
     )
-
     if not lesson:
-        return jsonify({'success': False, 'message': 'Failed to create lesson'}), 500
+        current_user.add_tokens(1, 'lesson_refund', source)
+    return lesson
+
+def run_lesson_job(job, user_id, grade_level, topic, teaching_strategy, language, source, force_fresh=False):
+    """Background task: stream the plan from the LLM into a new lessons row.
+
+    The row is created up front so the partial plan can be saved every
+    LESSON_STREAM_SAVE_INTERVAL seconds; chunks are also published on the job
+    for the SSE endpoint. If the LLM fails, or produces nothing within
+    LESSON_DRAFT_AFTER seconds, the lesson gets a local fast draft instead,
+    flagged ``draft`` in the job result. Drafts are English-only, so in other
+    languages the job waits for the LLM and fails (refunded) if it fails.
+    """
+    lesson = None
+    try:
+        gpt_plan = gpt_plans(grade_level, topic, teaching_strategy, language)
+        lesson = Lesson.create(
+            user_id=user_id,
+            grade_level=grade_level,
+            topic=topic,
+            teaching_strategy=teaching_strategy,
+            language=language,
+            generated_plan='',
+            gpt_plan=gpt_plan,
+            reusable=False
+        )
+        if not lesson:
+            raise RuntimeError('Failed to create lesson')
+        job.result = {'lesson_id': lesson.id}
+
+        reused = None if force_fresh else find_similar_lesson(grade_level, topic, teaching_strategy, language)
+        if reused:
+            job.result['reused_from'] = reused.id
+            job.append(reused.generated_plan)
+        else:
+            draft_fallback = fast_draft_available(language)
+            try:
+                stream_into_lesson(job, lesson, force_fresh,
+                                   current_app.config.get('LESSON_DRAFT_AFTER') if draft_fallback else None)
+            except Exception as e:
+                if job.chunks or not draft_fallback:
+                    raise
+                current_app.logger.warning(f"LLM unavailable for lesson {lesson.id}, using fast draft: {e}")
+                job.result['draft'] = True
+                job.append(generate_fast_draft(grade_level, topic, teaching_strategy, language))
+        # Only complete LLM plans become reusable; a fallback draft stays with its author
+        if lesson.update(generated_plan=''.join(job.chunks), reusable=not job.result.get('draft')) is None:
+            raise RuntimeError('Failed to save lesson plan')
+        if lesson.reusable:
+            lesson.index_topic()
+    except Exception as e:
+        if lesson:
+            lesson.delete()
+        user = User.get_by_id(user_id)
+        if user:
+            user.add_tokens(1, 'lesson_refund', source)
+        raise RuntimeError(f'Error generating lesson plan: {str(e)}')
+    return job.result
+
+def stream_into_lesson(job, lesson, force_fresh=False, first_chunk_timeout=None):
+    """Stream an LLM plan for ``lesson`` onto the job, saving the partial text periodically.
+
+    With ``first_chunk_timeout``, raises TimeoutError if the LLM has produced
+    nothing after that many seconds.
+    """
+    save_interval = current_app.config.get('LESSON_STREAM_SAVE_INTERVAL', 5)
+    chunks = stream_lesson_plan(lesson.grade_level, lesson.topic, lesson.teaching_strategy,
+                                lesson.language, force_fresh=force_fresh)
+    if first_chunk_timeout:
+        chunks = StreamPump(chunks)
+        if not chunks.wait_started(first_chunk_timeout):
+            chunks.cancel()
+            raise TimeoutError(f'no output after {first_chunk_timeout:g}s')
+    last_save = time.monotonic()
+    for text in chunks:
+        job.append(text)
+        if time.monotonic() - last_save >= save_interval:
+            lesson.update(generated_plan=''.join(job.chunks))
+            last_save = time.monotonic()
+
+@routes.route('/api/lessons/<int:lesson_id>/refine', methods=['POST'])
+@login_required
+def refine_lesson(lesson_id):
+    """Replace a lesson's plan (typically a fast draft) with a full LLM generation."""
+    lesson = Lesson.get_by_id(lesson_id)
+    if not lesson:
+        return jsonify({'success': False, 'message': 'Lesson not found'}), 404
+    if lesson.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Unauthorized access'}), 403
 
-    return jsonify({'success': True, 'lesson': lesson.to_dict()})
+    if not current_user.deduct_tokens(1, 'lesson_refine', 'app'):
+        return jsonify({'success': False, 'message': 'Insufficient tokens', 'notify': 'نفدت التوكنز المتاحة. الرجاء الترقية أو انتظار التجديد الشهري.'}), 403
+    try:
+        job = job_queue.submit(current_user.id, 'lesson_refine', run_refine_job, current_user.id, lesson_id)
+    except QueueFull:
+        current_user.add_tokens(1, 'lesson_refund', 'app')
+        return jsonify({'success': False, 'message': 'Server is busy, please try again shortly'}), 503
+    return jsonify({'success': True, 'job_id': job.id, 'status': job.status}), 202
+
+def run_refine_job(job, user_id, lesson_id):
+    """Background task: regenerate an existing lesson's plan with the LLM.
+
+    The current plan is kept if generation fails.
+    """
+    lesson = Lesson.get_by_id(lesson_id)
+    if not lesson:
+        raise RuntimeError('Lesson not found')
+    original = lesson.generated_plan
+    job.result = {'lesson_id': lesson.id}
+    try:
+        stream_into_lesson(job, lesson)
+        if lesson.update(generated_plan=''.join(job.chunks), reusable=True) is None:
+            raise RuntimeError('Failed to save lesson plan')
+    except Exception as e:
+        lesson.update(generated_plan=original)
+        user = User.get_by_id(user_id)
+        if user:
+            user.add_tokens(1, 'lesson_refund', 'app')
+        raise RuntimeError(f'Error refining lesson plan: {str(e)}')
+    lesson.index_topic()
+    return job.result
+
+def find_similar_lesson(grade_level, topic, teaching_strategy, language):
+    """Return an earlier lesson whose topic is a near-identical spelling of ``topic``, if any."""
+    threshold = current_app.config.get('TOPIC_SIMILARITY_THRESHOLD', 0.85)
+    for lesson_id, score in topic_index.find_similar(topic, grade_level, teaching_strategy, language, threshold):
+        lesson = Lesson.get_by_id(lesson_id)
+        # Another worker may have edited or deleted it since this index was built
+        if lesson and lesson.generated_plan and lesson.reusable:
+            return lesson
+        topic_index.remove(lesson_id)
+    return None
+
+@routes.route('/api/jobs/<job_id>/stream', methods=['GET'])
+@login_required
+def stream_job(job_id):
+    """Server-Sent Events feed of a generation job's output as it arrives."""
+    job = job_queue.get(job_id)
+    if not job or str(job.user_id) != str(current_user.id):
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+
+    def events():
+        offset = 0
+        while True:
+            chunks = job.read(offset)
+            if chunks:
+                offset += len(chunks)
+                yield f"data: {json.dumps({'text': ''.join(chunks)}, ensure_ascii=False)}\n\n"
+            elif job.finished:
+                yield f"event: {job.status}\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+                return
+            else:
+                yield ": keep-alive\n\n"
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @routes.route('/api/attendance/confirm', methods=['POST'])
 @login_required
@@ -143,18 +493,11 @@ def admin_reset_balance(user_id):
     supabase.table('users').update({
         'token_balance': quota
     }).eq('id', user_id).execute()
+    User.invalidate_cache(user_id)
     
-    # Optional: Log this action in TokenTransaction
-    try:
-        TokenTransaction.create(
-            user_id=user_id,
-            amount=quota,
-            transaction_type='admin_reset',
-            source='admin',
-            reason='Balance reset by admin'
-        )
-    except:
-        pass  # If transaction logging fails, continue anyway
+    change = quota - (target.token_balance or 0)
+    if change != 0:
+        TokenTransaction.create(user_id, change, 'admin_reset', 'admin', {'admin_id': current_user.id})
     
     return jsonify({'success': True, 'new_balance': quota})
 
@@ -163,23 +506,74 @@ def require_admin():
     if not current_user.is_admin():
         abort(404)
 
+def directory_filters():
+    """Search and filter arguments of the admin user directory, shared with the CSV export."""
+    return {
+        'search': request.args.get('q', '').strip() or None,
+        'role': request.args.get('role') or None,
+        'max_balance': request.args.get('max_balance', type=int),
+    }
+
+def directory_page():
+    per_page = min(max(request.args.get('per_page', current_app.config['ADMIN_USERS_PAGE_SIZE'], type=int), 1), 200)
+    page = max(request.args.get('page', 1, type=int), 1)
+    sort = request.args.get('sort', 'name')
+    desc = request.args.get('order') == 'desc'
+    users, total = User.directory(sort=sort, desc=desc, limit=per_page, offset=(page - 1) * per_page,
+                                  **directory_filters())
+    return {'users': users, 'total': total, 'page': page, 'per_page': per_page,
+            'pages': max((total + per_page - 1) // per_page, 1)}
+
 @routes.route('/admin')
 @login_required
 def admin_dashboard():
     require_admin()
     language = session.get('language', 'en')
-    supabase = current_app.config["SUPABASE_CLIENT"]
-    r = supabase.table('users').select("id,name,email,role,monthly_token_quota,token_balance").order('name').execute()
-    users = r.data or []
-    return render_template('ادمن/dashboard.html', users=users, language=language)
+    return render_template('ادمن/dashboard.html', language=language, **directory_page())
 
 @routes.route('/api/admin/users', methods=['GET'])
 @login_required
 def admin_list_users():
+    """One page of users; accepts q (name/email prefix), role, max_balance, sort, order, page and per_page."""
     require_admin()
-    supabase = current_app.config["SUPABASE_CLIENT"]
-    r = supabase.table('users').select("id,name,email,role,monthly_token_quota,token_balance").order('name').execute()
-    return jsonify({'success': True, 'users': r.data or []})
+    try:
+        return jsonify({'success': True, **directory_page()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error listing users: {str(e)}'}), 500
+
+@routes.route('/api/admin/users/export.csv', methods=['GET'])
+@login_required
+def admin_export_users():
+    """All users matching the directory filters as CSV, streamed a chunk of rows at a time."""
+    require_admin()
+    filters = directory_filters()
+    chunk_size = current_app.config['ADMIN_EXPORT_CHUNK_SIZE']
+    columns = ['id', 'name', 'email', 'role', 'monthly_token_quota', 'token_balance', 'date_created']
+
+    def cell(value):
+        # Spreadsheet apps run cells starting with these as formulas; names and emails are user input
+        if isinstance(value, str) and value.startswith(('=', '+', '-', '@', '\t', '\r')):
+            return "'" + value
+        return value
+
+    def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # The BOM lets spreadsheet apps detect UTF-8, so Arabic names display correctly
+        yield '\ufeff'
+        writer.writerow(columns)
+        for i, user in enumerate(User.iter_directory(chunk_size=chunk_size, **filters), 1):
+            writer.writerow([cell(user.get(column)) for column in columns])
+            if i % chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    filename = f"users-{datetime.now().strftime('%Y%m%d-%H%M')}.csv"
+    return Response(stream_with_context(rows()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'Cache-Control': 'no-store'})
 
 @routes.route('/api/admin/users/<user_id>/role', methods=['PUT'])
 @login_required
@@ -187,7 +581,7 @@ def admin_update_role(user_id):
     require_admin()
     data = request.get_json() or {}
     new_role = data.get('role')
-    reset_balance = bool(data.get('reset_balance', False))
+    reset_balance = parse_flag(data.get('reset_balance', False))
     target = User.get_by_id(user_id)
     if not target:
         return jsonify({'success': False, 'message': 'User not found'}), 404
@@ -200,6 +594,7 @@ def admin_update_role(user_id):
         update['token_balance'] = quota
     supabase = current_app.config["SUPABASE_CLIENT"]
     supabase.table('users').update(update).eq('id', user_id).execute()
+    User.invalidate_cache(user_id)
     return jsonify({'success': True})
 
 @routes.route('/api/admin/users/<user_id>/tokens', methods=['PUT'])
@@ -221,6 +616,9 @@ def admin_update_tokens(user_id):
         update['token_balance'] = set_balance
     if update:
         supabase.table('users').update(update).eq('id', user_id).execute()
+        User.invalidate_cache(user_id)
+        if 'token_balance' in update:
+            target.token_balance = update['token_balance']
     if isinstance(adjust, int) and adjust != 0:
         if adjust > 0:
             target.add_tokens(adjust, 'admin_adjustment', 'admin')
@@ -229,6 +627,68 @@ def admin_update_tokens(user_id):
                 return jsonify({'success': False, 'message': 'Insufficient tokens for deduction'}), 400
     return jsonify({'success': True})
 
+@routes.route('/api/admin/users/bulk', methods=['POST'])
+@login_required
+def admin_bulk_update():
+    """Apply a role change, balance reset or token adjustment to many users at once.
+
+    Body: ``action`` (set_role, reset_balance or adjust_tokens), the targets as
+    ``user_ids`` or a directory ``filter`` ({q, role, max_balance}), and
+    ``role``/``reset_balance`` or ``adjust``. Returns per-user outcomes.
+    """
+    require_admin()
+    data = request.get_json() or {}
+    action = data.get('action')
+    user_ids = data.get('user_ids')
+    filters = data.get('filter')
+    if action not in BULK_ACTIONS:
+        return jsonify({'success': False, 'message': f"action must be one of: {', '.join(BULK_ACTIONS)}"}), 400
+    if (user_ids is None) == (filters is None):
+        return jsonify({'success': False, 'message': 'Provide either user_ids or filter'}), 400
+    if action == 'set_role' and not data.get('role'):
+        return jsonify({'success': False, 'message': 'role is required'}), 400
+    adjust = data.get('adjust')
+    if action == 'adjust_tokens' and (not isinstance(adjust, int) or isinstance(adjust, bool) or adjust == 0):
+        return jsonify({'success': False, 'message': 'adjust must be a non-zero integer'}), 400
+
+    max_users = current_app.config['ADMIN_BULK_MAX_USERS']
+    if user_ids is not None:
+        if not isinstance(user_ids, list) or not user_ids:
+            return jsonify({'success': False, 'message': 'user_ids must be a non-empty list'}), 400
+        user_ids = list(dict.fromkeys(user_ids))
+        target_count = len(user_ids)
+    else:
+        if not isinstance(filters, dict):
+            return jsonify({'success': False, 'message': 'filter must be an object'}), 400
+        max_balance = filters.get('max_balance')
+        if max_balance is not None and max_balance != '':
+            # A filter that fails to parse must not be dropped: that would widen the target set
+            try:
+                if isinstance(max_balance, (bool, float)):
+                    raise ValueError
+                max_balance = int(max_balance)
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'message': 'filter.max_balance must be an integer'}), 400
+        else:
+            max_balance = None
+        filters = {
+            'search': (filters.get('q') or '').strip() or None,
+            'role': filters.get('role') or None,
+            'max_balance': max_balance,
+        }
+        _, target_count = User.directory(limit=1, **filters)
+    if target_count > max_users:
+        return jsonify({'success': False, 'message': f'{target_count} users selected; at most {max_users} per request'}), 400
+
+    try:
+        outcome = run_bulk(current_app.config["SUPABASE_CLIENT"], current_app.config["LEDGER"], action,
+                           user_ids=user_ids, filters=filters, role=data.get('role'),
+                           reset=parse_flag(data.get('reset_balance', False)), adjust=adjust or 0,
+                           admin_id=current_user.id, chunk_size=current_app.config['ADMIN_BULK_CHUNK_SIZE'])
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Bulk update failed: {str(e)}'}), 500
+    return jsonify({'success': True, **outcome})
+
 @routes.route('/api/admin/role-configs', methods=['PUT'])
 @login_required
 def admin_update_role_configs():
@@ -245,10 +705,22 @@ def admin_update_role_configs():
             supabase.table('role_configs').update({'monthly_quota': monthly_quota}).eq('role', role).execute()
         else:
             supabase.table('role_configs').insert({'role': role, 'monthly_quota': monthly_quota}).execute()
+        RoleConfig.load()
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@routes.route('/api/admin/caches', methods=['GET'])
+@login_required
+def admin_cache_stats():
+    require_admin()
+    return jsonify({
+        'success': True,
+        'generation': generation_cache.stats(),
+        'users': user_cache.stats(),
+        'lesson_stats': lesson_stats_cache.stats()
+    })
+
 @routes.route('/api/admin/role-configs', methods=['GET'])
 @login_required
 def admin_list_role_configs():
@@ -260,50 +732,76 @@ def admin_list_role_configs():
 @routes.route('/api/lessons/<int:lesson_id>', methods=['GET'])
 @login_required
 def get_lesson(lesson_id):
-    lesson = Lesson.get_by_id(lesson_id)
+    # Check ownership and freshness from three small columns before fetching the plan text
+    version = Lesson.get_version(lesson_id)
     
-    if not lesson:
+    if not version:
         return jsonify({'success': False, 'message': 'Lesson not found'}), 404
 
     # Check if the lesson belongs to the current user
-    if lesson.user_id != current_user.id:
+    if version['user_id'] != current_user.id:
         return jsonify({'success': False, 'message': 'Unauthorized access'}), 403
 
-    return jsonify(lesson.to_dict())
+    # Weak comparison: compressed responses carry the ETag as a weak validator
+    etag = lesson_etag(version['date_modified'])
+    if etag and request.if_none_match.contains_weak(etag):
+        return conditional(Response(status=200), etag, parse_timestamp(version['date_modified']))
 
-@routes.route('/api/lessons/<int:lesson_id>', methods=['PUT'])
-@login_required
-def update_lesson(lesson_id):
     lesson = Lesson.get_by_id(lesson_id)
-    
     if not lesson:
         return jsonify({'success': False, 'message': 'Lesson not found'}), 404
 
-    # Check if the lesson belongs to the current user
-    if lesson.user_id != current_user.id:
-        return jsonify({'success': False, 'message': 'Unauthorized access'}), 403
+    return conditional(jsonify(lesson.to_dict()), lesson_etag(lesson.date_modified),
+                       parse_timestamp(lesson.date_modified))
 
-    data = request.get_json()
+@routes.route('/api/lessons/<int:lesson_id>', methods=['PUT'])
+@login_required
+def update_lesson(lesson_id):
+    data = request.get_json() or {}
+    changes = {key: data[key] for key in ('generated_plan', 'gpt_plan') if key in data}
+    # If-Match is optional here for existing clients; PATCH requires it
+    return save_lesson_changes(lesson_id, changes, if_match_version())
 
-    # Update lesson using Supabase
+@routes.route('/api/lessons/<int:lesson_id>', methods=['PATCH'])
+@login_required
+def patch_lesson(lesson_id):
+    """Update only the fields sent, if the lesson is still at the If-Match version."""
+    data = request.get_json() or {}
+    unknown = set(data) - LESSON_EDITABLE_FIELDS
+    if unknown:
+        return jsonify({'success': False, 'message': f"Fields cannot be changed: {', '.join(sorted(unknown))}"}), 400
+    if not data:
+        return jsonify({'success': False, 'message': 'No changes'}), 400
+    version = if_match_version()
+    if version is None:
+        return jsonify({'success': False, 'message': 'If-Match header with the lesson ETag is required'}), 428
+    return save_lesson_changes(lesson_id, data, version)
+
+LESSON_EDITABLE_FIELDS = {'generated_plan', 'gpt_plan', 'topic', 'grade_level', 'teaching_strategy', 'language'}
+
+def if_match_version():
+    """The lesson version (its ``date_modified``) named by If-Match, or None."""
+    versions = request.if_match.as_set(include_weak=True)
+    return next(iter(versions)) if len(versions) == 1 else None
+
+def save_lesson_changes(lesson_id, changes, expected_version):
+    if not changes:
+        return jsonify({'success': False, 'message': 'No changes'}), 400
     try:
-        supabase = current_app.config["SUPABASE_CLIENT"]
-        update_data = {}
-        
-        if 'generated_plan' in data:
-            update_data['generated_plan'] = data['generated_plan']
-        if 'gpt_plan' in data:
-            update_data['gpt_plan'] = data['gpt_plan']
-        
-        update_data['date_modified'] = 'now()'
-        
-        response = supabase.table('lessons').update(update_data).eq('id', lesson_id).execute()
-        
-        # Get updated lesson
-        updated_lesson = Lesson.get_by_id(lesson_id)
-        return jsonify({'success': True, 'lesson': updated_lesson.to_dict()})
+        lesson, error = Lesson.patch(lesson_id, current_user.id, changes, expected_version)
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error updating lesson: {str(e)}'}), 500
+    if error == 'not_found':
+        return jsonify({'success': False, 'message': 'Lesson not found'}), 404
+    if error == 'forbidden':
+        return jsonify({'success': False, 'message': 'Unauthorized access'}), 403
+    if error == 'conflict':
+        return jsonify({'success': False, 'message': 'The lesson was changed elsewhere; reload it before saving'}), 412
+    # Hand-edited plans are no longer offered to other teachers
+    topic_index.remove(lesson_id)
+    response = jsonify({'success': True, 'lesson': lesson.to_dict()})
+    response.set_etag(lesson_etag(lesson.date_modified))
+    return response
 
 @routes.route('/lessons/<int:lesson_id>/delete', methods=['POST'])
 @login_required
@@ -320,13 +818,8 @@ def delete_lesson_api(lesson_id):
         return redirect(url_for('routes.index'))
 
     try:
-        supabase = current_app.config["SUPABASE_CLIENT"]
-        
-        # Delete associated presentations first
-        supabase.table('presentations').delete().eq('lesson_id', lesson_id).execute()
-        
-        # Delete the lesson
-        supabase.table('lessons').delete().eq('id', lesson_id).execute()
+        Lesson.mark_deleted(lesson_id, lesson.user_id)
+        schedule_purge(current_user.id, 'lesson_purge', run_lesson_purge_job, lesson_id)
         
         flash('Lesson plan deleted successfully')
     except Exception as e:
@@ -347,18 +840,39 @@ def delete_lesson(lesson_id):
         return jsonify({'success': False, 'message': 'Unauthorized access'}), 403
 
     try:
-        supabase = current_app.config["SUPABASE_CLIENT"]
+        Lesson.mark_deleted(lesson_id, lesson.user_id)
+        job = schedule_purge(current_user.id, 'lesson_purge', run_lesson_purge_job, lesson_id)
         
-        # Delete associated presentations first
-        supabase.table('presentations').delete().eq('lesson_id', lesson_id).execute()
-        
-        # Delete the lesson
-        supabase.table('lessons').delete().eq('id', lesson_id).execute()
-        
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'job_id': job.id if job else None})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error deleting lesson: {str(e)}'}), 500
 
+def schedule_purge(user_id, kind, fn, *args):
+    """Queue background removal of rows already marked deleted.
+
+    Returns the Job, or None when the queue is full; the marked rows are
+    then picked up by ``flask purge-deleted``.
+    """
+    try:
+        return job_queue.submit(user_id, kind, fn, *args)
+    except QueueFull:
+        current_app.logger.warning(f"Job queue full; {kind} {args} left for purge-deleted")
+        return None
+
+def run_lesson_purge_job(job, lesson_id):
+    """Background task: delete a marked lesson with its presentations and files."""
+    job.result = {'lesson_id': lesson_id}
+    job.result.update(Lesson.purge_many([lesson_id]))
+    return job.result
+
+def run_account_purge_job(job, user_id):
+    """Background task: delete a marked account's rows chunk by chunk, reporting counts as it goes."""
+    job.result = {'stage': 'running'}
+    counts = User.purge(user_id, progress=job.result.update)
+    job.result.update(counts, stage='done')
+    current_app.logger.info(f"Purged account {user_id}: {counts}")
+    return job.result
+
 @routes.route('/api/lessons/<int:lesson_id>/presentation', methods=['POST'])
 @login_required
 def generate_presentation(lesson_id):
@@ -388,6 +902,7 @@ def generate_presentation(lesson_id):
 
         if not presentation:
             return jsonify({'success': False, 'message': 'Failed to create presentation record'}), 500
+        Lesson.invalidate_stats(lesson.user_id)
 
         return jsonify({
             'success': True,
@@ -481,26 +996,36 @@ def register():
 @routes.route('/dashboard')
 @login_required
 def dashboard():
-    # Get user's lessons using Supabase
-    all_lessons = Lesson.get_all_by_user(current_user.id)
-    total_lessons = len(all_lessons)
-    recent_lessons = all_lessons[:5]  # First 5 (already ordered by date_created desc)
-
     language = session.get('language', 'en')
 
-    return render_template('dashboard.html',
-                          total_lessons=total_lessons,
-                          recent_lessons=recent_lessons,
-                          language=language)
+    return render_template('dashboard.html', language=language, **dashboard_data(current_user))
+
+@routes.route('/api/dashboard', methods=['GET'])
+@login_required
+def get_dashboard():
+    data = dashboard_data(current_user)
+    data['recent_lessons'] = [lesson.to_summary_dict() for lesson in data['recent_lessons']]
+    return conditional(jsonify({'success': True, **data}))
+
+def dashboard_data(user):
+    """Dashboard figures from an exact count, a five-row summary page and the cached aggregates."""
+    recent_lessons, _ = Lesson.get_page_by_user(user.id, limit=5)
+    return {
+        'total_lessons': Lesson.count_by_user(user.id),
+        'recent_lessons': recent_lessons,
+        'stats': Lesson.stats_for_user(user.id),
+        'token_balance': user.token_balance
+    }
 
 @routes.route('/lessons')
 @login_required
 def get_lessons_page():
-    # Get all lessons for the current user using Supabase
-    lessons = Lesson.get_all_by_user(current_user.id)
+    cursor = request.args.get('cursor')
+    lessons, next_cursor = Lesson.get_page_by_user(current_user.id, current_app.config['LESSON_PAGE_SIZE'], cursor)
     language = session.get('language', 'en')
 
-    return render_template('lesson_list.html', lessons=lessons, language=language)
+    return render_template('lesson_list.html', lessons=lessons, next_cursor=next_cursor,
+                           paged=bool(cursor), language=language)
 
 @routes.route('/logout')
 def logout():
@@ -522,40 +1047,30 @@ def create_lesson_form():
         if not current_user.deduct_tokens(1, 'lesson_create', 'web'):
             flash('Insufficient tokens' if language == 'en' else 'نفدت التوكنز المتاحة. الرجاء الترقية أو انتظار التجديد الشهري.')
             return render_template('create_lesson.html', form=form, language=language)
-        # Generate lesson plan content first
-        try:
-            lesson_plan = generate_lesson_plan(
-                form.grade_level.data,
-                form.topic.data,
-                form.teaching_strategy.data,
-                form.language.data
-            )
-            gpt_plan = gpt_plans(
+        if form.fast_draft.data:
+            lesson = create_draft_lesson(
                 form.grade_level.data,
                 form.topic.data,
                 form.teaching_strategy.data,
-                form.language.data
+                form.language.data,
+                'web'
             )
-        except Exception as e:
-            flash(f'Error generating lesson plan: {str(e)}')
+            if lesson:
+                flash('Lesson plan created successfully!')
+                return redirect(url_for('routes.edit_lesson_form', lesson_id=lesson.id))
+            flash('Failed to create lesson plan')
             return render_template('create_lesson.html', form=form, language=language)
-
-        # Create new lesson using Supabase
-        lesson = Lesson.create(
-            user_id=current_user.id,
-            grade_level=form.grade_level.data,
-            topic=form.topic.data,
-            teaching_strategy=form.teaching_strategy.data,
-            language=form.language.data,
-            generated_plan=lesson_plan,
-            gpt_plan=gpt_plan
+        job = enqueue_lesson_job(
+            form.grade_level.data,
+            form.topic.data,
+            form.teaching_strategy.data,
+            form.language.data,
+            'web',
+            force_fresh=form.force_fresh.data
         )
-
-        if lesson:
-            flash('Lesson plan created successfully!')
-            return redirect(url_for('routes.edit_lesson_form', lesson_id=lesson.id))
-        else:
-            flash('Failed to create lesson plan')
+        if job:
+            return render_template('create_lesson.html', form=form, language=language, job_id=job.id)
+        flash('Server is busy, please try again shortly' if language == 'en' else 'الخادم مشغول، الرجاء المحاولة بعد قليل.')
 
     return render_template('create_lesson.html', form=form, language=language)
 
@@ -578,15 +1093,23 @@ def edit_lesson_form(lesson_id):
     if request.method == 'GET':
         form.generated_plan.data = lesson.generated_plan
         form.gpt_plan.data = lesson.gpt_plan
+        form.version.data = lesson.date_modified
 
     if form.validate_on_submit():
         try:
-            supabase = current_app.config["SUPABASE_CLIENT"]
-            supabase.table('lessons').update({
-                'generated_plan': form.generated_plan.data,
-                'gpt_plan': form.gpt_plan.data,
-                'date_modified': 'now()'
-            }).eq('id', lesson_id).execute()
+            changes = {key: getattr(form, key).data for key in ('generated_plan', 'gpt_plan')
+                       if getattr(form, key).data != getattr(lesson, key)}
+            if changes:
+                updated, error = Lesson.patch(lesson_id, current_user.id, changes, form.version.data or None)
+                if error == 'conflict':
+                    flash('This lesson was changed in another window. Your edits were not saved; '
+                          'copy them, then reload the page.' if language == 'en' else
+                          'تم تعديل هذا الدرس في نافذة أخرى ولم يتم حفظ تعديلاتك. انسخها ثم أعد تحميل الصفحة.')
+                    return render_template('edit_lesson.html', form=form, lesson=lesson, language=language)
+                if error:
+                    flash('Lesson not found')
+                    return redirect(url_for('routes.index'))
+                topic_index.remove(lesson_id)
             
             flash('Lesson plan updated successfully!')
             return redirect(url_for('routes.edit_lesson_form', lesson_id=lesson.id))
@@ -620,6 +1143,7 @@ def user():
                 update_data['password_hash'] = generate_password_hash(form.new_password.data)
 
             supabase.table('users').update(update_data).eq('id', current_user.id).execute()
+            User.invalidate_cache(current_user.id)
             
             flash('Profile updated successfully!' if language == 'en' else 'تم تحديث الملف الشخصي بنجاح!')
             return redirect(url_for('routes.user'))
@@ -639,13 +1163,10 @@ def delete_account():
     language = session.get('language', 'en')
 
     try:
-        supabase = current_app.config["SUPABASE_CLIENT"]
-        
-        # Delete user's lessons first (cascade should handle presentations)
-        supabase.table('lessons').delete().eq('user_id', current_user.id).execute()
-        
-        # Delete user
-        supabase.table('users').delete().eq('id', current_user.id).execute()
+        user_id = current_user.id
+        # Disable the account now; lessons, presentations, files and ledger rows go in the background
+        User.mark_deleted(user_id)
+        schedule_purge(user_id, 'account_purge', run_account_purge_job, user_id)
         
         logout_user()
         flash('Your account has been deleted.' if language == 'en' else 'تم حذف حسابك.')
@@ -727,6 +1248,7 @@ def download_lesson(lesson_id):
         .select("*")
         .eq("id", lesson_id)
         .eq("user_id", current_user.id)
+        .is_("deleted_at", "null")
         .single()
         .execute()
     )
@@ -765,16 +1287,29 @@ def download_lesson(lesson_id):
             if "**" in line:
                 run.bold = True
 
-    file_stream = tempfile.NamedTemporaryFile(delete=False, suffix=".docx")
-    doc.save(file_stream.name)
+    # Built in memory so no .docx is left behind on disk
+    file_stream = io.BytesIO()
+    doc.save(file_stream)
+    file_stream.seek(0)
 
     return send_file(
-        file_stream.name,
+        file_stream,
         as_attachment=True,
         download_name=f'{lesson["topic"]}.docx',
         mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
     )
 
+@routes.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint: needs the METRICS_TOKEN bearer token, or an admin session when it is unset."""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(404)
+    elif not (current_user.is_authenticated and current_user.is_admin()):
+        abort(404)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @routes.route('/sitemap.xml')
 def sitemap():
     from flask import send_from_directory
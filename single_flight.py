@@ -0,0 +1,163 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalesce within the process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.result = None
+
+    def publish(self, text):
+        with self.cond:
+            self.chunks.append(text)
+            self.cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self.cond:
+            self.result = result
+            self.error = error
+            self.done = True
+            self.cond.notify_all()
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls onto one upstream call.
+
+    Within a process, callers with the same key wait for the first caller
+    (the leader) and share its result, or follow its stream chunk by chunk.
+    Across worker processes the leader also holds an ``flock`` on a per-key
+    file in ``lock_dir``; a caller in another process waits for that lock
+    and then asks ``recheck`` whether the result has appeared (e.g. in the
+    shared generation cache) before calling upstream itself.
+    """
+
+    def __init__(self, lock_dir=None, lock_timeout=180):
+        self.lock_dir = lock_dir
+        self.lock_timeout = lock_timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _leave(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    @contextmanager
+    def _process_lock(self, key):
+        if fcntl is None or not self.lock_dir:
+            yield
+            return
+        os.makedirs(self.lock_dir, exist_ok=True)
+        path = os.path.join(self.lock_dir, f"{key}.lock")
+        handle = open(path, 'a')
+        deadline = time.monotonic() + self.lock_timeout
+        locked = False
+        try:
+            while True:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        logger.warning(f"Timed out waiting for generation lock {key}; proceeding without it")
+                        break
+                    time.sleep(0.1)
+            yield
+        finally:
+            if locked:
+                # Unlinking may let a later caller create a fresh lock file and miss
+                # coalescing, but never lets two callers share a result incorrectly.
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    def do(self, key, fn, recheck=None):
+        """Return ``fn()``, sharing one call among concurrent callers with ``key``."""
+        flight, leader = self._join(key)
+        if not leader:
+            with flight.cond:
+                while not flight.done:
+                    flight.cond.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            started = time.time()
+            with self._process_lock(key):
+                result = recheck(started) if recheck else None
+                if result is None:
+                    result = fn()
+            flight.finish(result=result)
+            return result
+        except Exception as e:
+            flight.finish(error=e)
+            raise
+        finally:
+            self._leave(key, flight)
+
+    def stream(self, key, fn, recheck=None):
+        """Yield the chunks of ``fn()``, sharing one stream among concurrent callers with ``key``."""
+        flight, leader = self._join(key)
+        if not leader:
+            offset = 0
+            while True:
+                with flight.cond:
+                    while len(flight.chunks) <= offset and not flight.done:
+                        flight.cond.wait()
+                    chunks = flight.chunks[offset:]
+                    done, error = flight.done, flight.error
+                offset += len(chunks)
+                yield from chunks
+                if done and offset >= len(flight.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        error = None
+        try:
+            started = time.time()
+            with self._process_lock(key):
+                cached = recheck(started) if recheck else None
+                if cached is not None:
+                    flight.publish(cached)
+                    yield cached
+                else:
+                    for text in fn():
+                        flight.publish(text)
+                        yield text
+        except BaseException as e:
+            error = e if isinstance(e, Exception) else RuntimeError('Generation was abandoned')
+            raise
+        finally:
+            flight.finish(error=error)
+            self._leave(key, flight)
+
+
+single_flight = SingleFlight(
+    lock_dir=os.environ.get("SINGLE_FLIGHT_LOCK_DIR", os.path.join(tempfile.gettempdir(), "lessonplan-locks"))
+)
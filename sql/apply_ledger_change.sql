@@ -0,0 +1,36 @@
+-- Atomic token ledger operation used by ledger.SupabaseLedger.
+--
+-- Applies p_change to the user's balance and records the matching
+-- token_transactions row in one transaction. A decrement that would take the
+-- balance below zero is rejected (returns NULL) unless p_allow_negative.
+-- Returns the new balance.
+
+create or replace function apply_ledger_change(
+    p_user_id users.id%TYPE,
+    p_change integer,
+    p_reason text,
+    p_source text,
+    p_meta jsonb default null,
+    p_allow_negative boolean default false
+) returns integer
+language plpgsql
+as $$
+declare
+    v_balance integer;
+begin
+    update users
+       set token_balance = coalesce(token_balance, 0) + p_change
+     where id = p_user_id
+       and (p_allow_negative or coalesce(token_balance, 0) + p_change >= 0)
+    returning token_balance into v_balance;
+
+    if not found then
+        return null;
+    end if;
+
+    insert into token_transactions (user_id, change, reason, source, meta)
+    values (p_user_id, p_change, p_reason, p_source, p_meta);
+
+    return v_balance;
+end;
+$$;
@@ -0,0 +1,43 @@
+-- Set-based variant of apply_ledger_change, used by ledger.SupabaseLedger.apply_many
+-- (bulk admin operations).
+--
+-- p_updates is a JSON array of {"id", "expected_balance", "token_balance"} objects,
+-- optionally with "role", "monthly_token_quota" and "token_renewal_date". Each user's balance is set to
+-- token_balance only if it still equals expected_balance (null matches null). The
+-- matching token_transactions rows are inserted in the same transaction. Returns a
+-- JSON array of {"id", "token_balance"} for the users that were updated.
+
+create or replace function apply_ledger_changes(
+    p_updates jsonb,
+    p_reason text,
+    p_source text,
+    p_meta jsonb default null
+) returns jsonb
+language sql
+as $$
+    with input as (
+        select r.id, r.token_balance, r.role, r.monthly_token_quota, r.token_renewal_date,
+               (e.value ->> 'expected_balance')::integer as expected_balance
+          from jsonb_array_elements(p_updates) as e(value),
+               lateral jsonb_populate_record(null::users, e.value) as r
+    ), updated as (
+        update users u
+           set token_balance = i.token_balance,
+               role = coalesce(i.role, u.role),
+               monthly_token_quota = coalesce(i.monthly_token_quota, u.monthly_token_quota),
+               token_renewal_date = coalesce(i.token_renewal_date, u.token_renewal_date)
+          from input i
+         where u.id = i.id
+           and u.deleted_at is null
+           and u.token_balance is not distinct from i.expected_balance
+        returning u.id, u.token_balance, i.expected_balance
+    ), logged as (
+        insert into token_transactions (user_id, change, reason, source, meta)
+        select id, token_balance - coalesce(expected_balance, 0), p_reason, p_source, p_meta
+          from updated
+         where token_balance <> coalesce(expected_balance, 0)
+        returning 1
+    )
+    select coalesce(jsonb_agg(jsonb_build_object('id', id, 'token_balance', token_balance)), '[]'::jsonb)
+      from updated;
+$$;
@@ -0,0 +1,16 @@
+-- Background job state (jobs.JobQueue), shared so that a job's status, result and
+-- streamed output can be read from any worker, not only the one running it.
+-- Rows are removed JOB_RETENTION_SECONDS after they were created.
+create table if not exists jobs (
+    id text primary key,
+    user_id text,
+    kind text,
+    status text,
+    result jsonb,
+    error text,
+    output text,
+    date_created timestamptz default now(),
+    date_finished timestamptz
+);
+
+create index if not exists jobs_date_created_idx on jobs (date_created);
@@ -0,0 +1,7 @@
+-- Whether a lesson's plan may be offered to other teachers through the topic index
+-- (TopicIndex.load / routes.find_similar_lesson). Fast drafts and hand-edited plans
+-- are stored with reusable = false.
+alter table lessons add column if not exists reusable boolean not null default true;
+
+create index if not exists lessons_reusable_id_idx on lessons (id)
+    where reusable and deleted_at is null;
@@ -0,0 +1,39 @@
+-- Dashboard aggregates for one user (models.Lesson.stats_for_user), computed in the
+-- database so no lesson rows are shipped and PostgREST's max-rows limit does not apply.
+-- Returns {"presentations", "by_strategy", "by_grade", "tokens_used_this_month"}.
+
+create or replace function lesson_stats(
+    p_user_id users.id%TYPE,
+    p_since timestamptz
+) returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'presentations', (
+            select count(*)
+              from presentations p
+              join lessons l on l.id = p.lesson_id
+             where l.user_id = p_user_id and l.deleted_at is null
+        ),
+        'by_strategy', coalesce((
+            select jsonb_object_agg(strategy, n)
+              from (select coalesce(nullif(teaching_strategy, ''), 'unknown') as strategy, count(*) as n
+                      from lessons
+                     where user_id = p_user_id and deleted_at is null
+                     group by 1) s
+        ), '{}'::jsonb),
+        'by_grade', coalesce((
+            select jsonb_object_agg(grade, n)
+              from (select coalesce(nullif(grade_level::text, ''), 'unknown') as grade, count(*) as n
+                      from lessons
+                     where user_id = p_user_id and deleted_at is null
+                     group by 1) g
+        ), '{}'::jsonb),
+        'tokens_used_this_month', coalesce((
+            select -sum(change)
+              from token_transactions
+             where user_id = p_user_id and change < 0 and date_created >= p_since
+        ), 0)
+    );
+$$;
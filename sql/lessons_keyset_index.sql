@@ -0,0 +1,4 @@
+-- Supports keyset pagination of a user's lessons (Lesson.get_page_by_user):
+-- WHERE user_id = ? AND (date_created, id) < (?, ?) ORDER BY date_created DESC, id DESC
+create index if not exists lessons_user_created_id_idx
+    on lessons (user_id, date_created desc, id desc);
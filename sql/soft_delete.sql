@@ -0,0 +1,8 @@
+-- Rows marked for background purging (models.User.mark_deleted / Lesson.mark_deleted).
+-- Reads skip marked rows; routes.run_*_purge_job and `flask purge-deleted` remove them.
+alter table users add column if not exists deleted_at timestamptz;
+alter table lessons add column if not exists deleted_at timestamptz;
+
+create index if not exists users_deleted_at_idx on users (deleted_at) where deleted_at is not null;
+create index if not exists lessons_deleted_at_idx on lessons (deleted_at) where deleted_at is not null;
+create index if not exists token_transactions_user_id_idx on token_transactions (user_id, id);
@@ -0,0 +1,13 @@
+-- Supports the admin user directory (User.directory / User.iter_directory).
+-- Prefix search: name ilike 'abc%' or email ilike 'abc%' uses the trigram indexes.
+create extension if not exists pg_trgm;
+
+create index if not exists users_name_trgm_idx
+    on users using gin (name gin_trgm_ops);
+create index if not exists users_email_trgm_idx
+    on users using gin (email gin_trgm_ops);
+
+-- Sorting by name, and the role and low-balance filters
+create index if not exists users_name_id_idx on users (name, id);
+create index if not exists users_role_name_idx on users (role, name);
+create index if not exists users_token_balance_idx on users (token_balance);
@@ -0,0 +1,526 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+NOW = "(strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    email TEXT UNIQUE,
+    password_hash TEXT,
+    password TEXT,
+    role TEXT DEFAULT 'student',
+    monthly_token_quota INTEGER,
+    token_balance INTEGER DEFAULT 0,
+    token_renewal_date TEXT,
+    date_created TEXT DEFAULT {NOW},
+    deleted_at TEXT
+);
+CREATE INDEX IF NOT EXISTS users_token_renewal_date_idx ON users (token_renewal_date);
+CREATE INDEX IF NOT EXISTS users_name_id_idx ON users (name, id);
+CREATE INDEX IF NOT EXISTS users_role_name_idx ON users (role, name);
+CREATE INDEX IF NOT EXISTS users_token_balance_idx ON users (token_balance);
+
+CREATE TABLE IF NOT EXISTS lessons (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+    grade_level TEXT,
+    topic TEXT,
+    teaching_strategy TEXT,
+    language TEXT,
+    generated_plan TEXT,
+    gpt_plan TEXT,
+    reusable INTEGER NOT NULL DEFAULT 1,
+    date_created TEXT DEFAULT {NOW},
+    date_modified TEXT DEFAULT {NOW},
+    deleted_at TEXT
+);
+CREATE INDEX IF NOT EXISTS lessons_user_created_id_idx ON lessons (user_id, date_created DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS presentations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lesson_id INTEGER REFERENCES lessons (id) ON DELETE CASCADE,
+    file_path TEXT,
+    date_created TEXT DEFAULT {NOW}
+);
+CREATE INDEX IF NOT EXISTS presentations_lesson_id_idx ON presentations (lesson_id);
+
+CREATE TABLE IF NOT EXISTS role_configs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    role TEXT UNIQUE NOT NULL,
+    monthly_quota INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS token_transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+    change INTEGER NOT NULL,
+    reason TEXT,
+    source TEXT,
+    meta TEXT,
+    date_created TEXT DEFAULT {NOW}
+);
+CREATE INDEX IF NOT EXISTS token_transactions_user_created_idx ON token_transactions (user_id, date_created);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    kind TEXT,
+    status TEXT,
+    result TEXT,
+    error TEXT,
+    output TEXT,
+    date_created TEXT DEFAULT {NOW},
+    date_finished TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_date_created_idx ON jobs (date_created);
+"""
+
+# Columns added after the first release; created on databases that predate them
+ADDED_COLUMNS = [
+    ('users', 'deleted_at', 'TEXT'),
+    ('lessons', 'deleted_at', 'TEXT'),
+    ('lessons', 'reusable', 'INTEGER NOT NULL DEFAULT 1'),
+]
+
+# Many-to-one relations that can be embedded in a select, e.g. 'id, lessons!inner(user_id)'
+FOREIGN_KEYS = {
+    'lessons': {'users': 'user_id'},
+    'presentations': {'lessons': 'lesson_id'},
+    'token_transactions': {'users': 'user_id'},
+}
+
+JSON_COLUMNS = {'meta', 'result'}
+
+# Columns stamped on every update, as the Postgres schema's defaults/triggers would
+TOUCH_COLUMNS = {'lessons': 'date_modified'}
+
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+OPERATORS = {'eq': '=', 'neq': '!=', 'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>=',
+             'like': 'LIKE', 'ilike': 'LIKE'}
+
+
+class StorageError(Exception):
+    pass
+
+
+class Response:
+    """Mirrors the ``data``/``count`` attributes of a postgrest APIResponse."""
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _ident(name):
+    if not IDENTIFIER.match(name):
+        raise StorageError(f"Invalid identifier: {name!r}")
+    return f'"{name}"'
+
+
+def _column(table, name):
+    """``col`` or ``embedded.col`` as a qualified SQL column reference."""
+    if '.' in name:
+        table, name = name.split('.', 1)
+    return f'{_ident(table)}.{_ident(name)}'
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+
+
+def _encode(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if value == 'now()':
+        return _now()
+    return value
+
+
+def _split_top_level(text):
+    """Split a PostgREST logic-tree string on commas outside parentheses and quotes."""
+    parts, depth, quoted, current = [], 0, False, []
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        if ch == ',' and depth == 0 and not quoted:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(ch)
+    if current:
+        parts.append(''.join(current))
+    return parts
+
+
+class _Query:
+    """The subset of the postgrest query builder used by this app."""
+
+    def __init__(self, client, table):
+        _ident(table)
+        self.client = client
+        self.table = table
+        self.action = 'select'
+        self.columns = '*'
+        self.count = None
+        self.payload = None
+        self.where = []
+        self.params = []
+        self.orders = []
+        self.limit_n = None
+        self.offset_n = None
+        self.single_row = False
+
+    # Actions
+    def select(self, columns='*', count=None):
+        self.action, self.columns, self.count = 'select', columns, count
+        return self
+
+    def insert(self, rows):
+        self.action, self.payload = 'insert', rows
+        return self
+
+    def update(self, values):
+        self.action, self.payload = 'update', values
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    # Filters
+    def _filter(self, column, op, value):
+        sql_column = _column(self.table, column)
+        if op in ('like', 'ilike'):
+            # SQLite's LIKE is already case-insensitive for ASCII
+            # Backslash escapes % and _, as in Postgres
+            self.where.append(f"{sql_column} LIKE ? ESCAPE '\\'")
+            self.params.append(str(value).replace('*', '%'))
+        elif op == 'is':
+            self.where.append(f'{sql_column} IS NULL' if value in (None, 'null') else f'{sql_column} IS ?')
+            if value not in (None, 'null'):
+                self.params.append(value)
+        else:
+            self.where.append(f'{sql_column} {OPERATORS[op]} ?')
+            self.params.append(_encode(value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, 'eq', value)
+
+    def neq(self, column, value):
+        return self._filter(column, 'neq', value)
+
+    def lt(self, column, value):
+        return self._filter(column, 'lt', value)
+
+    def lte(self, column, value):
+        return self._filter(column, 'lte', value)
+
+    def gt(self, column, value):
+        return self._filter(column, 'gt', value)
+
+    def gte(self, column, value):
+        return self._filter(column, 'gte', value)
+
+    def like(self, column, value):
+        return self._filter(column, 'like', value)
+
+    def ilike(self, column, value):
+        return self._filter(column, 'ilike', value)
+
+    def is_(self, column, value):
+        return self._filter(column, 'is', value)
+
+    def in_(self, column, values):
+        values = list(values)
+        if not values:
+            self.where.append('0')
+            return self
+        self.where.append(f'{_column(self.table, column)} IN ({", ".join("?" for _ in values)})')
+        self.params.extend(_encode(v) for v in values)
+        return self
+
+    def or_(self, filters):
+        sql, params = self._logic('or', filters)
+        self.where.append(f'({sql})')
+        self.params.extend(params)
+        return self
+
+    def _logic(self, joiner, text):
+        clauses, params = [], []
+        for part in _split_top_level(text):
+            part = part.strip()
+            match = re.match(r'^(and|or)\((.*)\)$', part)
+            if match:
+                sql, sub = self._logic(match.group(1), match.group(2))
+            else:
+                column, op, value = part.split('.', 2)
+                if value.startswith('"') and value.endswith('"'):
+                    value = value[1:-1]
+                if op == 'is':
+                    sql, sub = (f'{_column(self.table, column)} IS NULL', []) if value == 'null' else \
+                        (f'{_column(self.table, column)} IS ?', [value])
+                elif op in ('like', 'ilike'):
+                    sql, sub = f"{_column(self.table, column)} LIKE ? ESCAPE '\\'", [value.replace('*', '%')]
+                elif op in OPERATORS:
+                    sql, sub = f'{_column(self.table, column)} {OPERATORS[op]} ?', [value]
+                else:
+                    raise StorageError(f"Unsupported filter operator: {op}")
+            clauses.append(f'({sql})')
+            params.extend(sub)
+        return f' {joiner.upper()} '.join(clauses), params
+
+    # Modifiers
+    def order(self, column, desc=False):
+        self.orders.append(f'{_column(self.table, column)} {"DESC" if desc else "ASC"}')
+        return self
+
+    def limit(self, n):
+        self.limit_n = int(n)
+        return self
+
+    def range(self, start, end):
+        self.offset_n = int(start)
+        self.limit_n = int(end) - int(start) + 1
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    def execute(self):
+        return self.client._execute(self)
+
+    # SQL generation
+    def _where_sql(self):
+        return f' WHERE {" AND ".join(self.where)}' if self.where else ''
+
+    def _select_sql(self):
+        """Returns the row query and the matching COUNT(*) query."""
+        columns, joins = [], []
+        for item in _split_top_level(self.columns):
+            item = item.strip()
+            match = re.match(r'^([A-Za-z_][A-Za-z0-9_]*)(!inner)?\((.*)\)$', item)
+            if match:
+                name, inner, sub = match.groups()
+                fk = FOREIGN_KEYS.get(self.table, {}).get(name)
+                if not fk:
+                    raise StorageError(f"No relation from {self.table} to {name}")
+                joins.append(f'{"JOIN" if inner else "LEFT JOIN"} {_ident(name)} '
+                             f'ON {_ident(name)}."id" = {_ident(self.table)}.{_ident(fk)}')
+                for c in (c.strip() for c in sub.split(',')):
+                    columns.append(f'{_ident(name)}.{_ident(c)} AS "{name}.{c}"')
+            elif item == '*':
+                columns.append(f'{_ident(self.table)}.*')
+            else:
+                columns.append(f'{_ident(self.table)}.{_ident(item)}')
+        source = f'{_ident(self.table)} {" ".join(joins)}'
+        sql = f'SELECT {", ".join(columns)} FROM {source}{self._where_sql()}'
+        if self.orders:
+            sql += f' ORDER BY {", ".join(self.orders)}'
+        if self.limit_n is not None or self.offset_n is not None:
+            sql += f' LIMIT {self.limit_n if self.limit_n is not None else -1} OFFSET {self.offset_n or 0}'
+        count_sql = f'SELECT COUNT(*) FROM {source}{self._where_sql()}'
+        return sql, count_sql
+
+
+class SQLiteClient:
+    """Embedded drop-in for the Supabase client, for single-node installs and offline benchmarks.
+
+    Implements ``table()`` with the query-builder subset the app uses, and
+    ``rpc()`` for the Postgres functions it calls, over one SQLite database
+    in WAL mode. Each thread gets its own connection; every statement
+    commits on its own, like a PostgREST request.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            conn.executescript(SCHEMA)
+            for table, column, kind in ADDED_COLUMNS:
+                existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {kind}')
+            self._local.conn = conn
+        return conn
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def rpc(self, name, params=None):
+        fn = getattr(self, f'_rpc_{name}', None)
+        if fn is None:
+            raise StorageError(f"Unknown function: {name}")
+        return _Call(fn, params or {})
+
+    def _rows(self, cursor):
+        rows = []
+        for row in cursor.fetchall():
+            item = {}
+            for key in row.keys():
+                value = row[key]
+                if key in JSON_COLUMNS and isinstance(value, str):
+                    value = json.loads(value)
+                if '.' in key:
+                    embed, column = key.split('.', 1)
+                    item.setdefault(embed, {})[column] = value
+                else:
+                    item[key] = value
+            rows.append(item)
+        return rows
+
+    def _execute(self, query):
+        conn = self._conn()
+        table = _ident(query.table)
+        count = None
+        if query.action == 'select':
+            sql, count_sql = query._select_sql()
+            data = self._rows(conn.execute(sql, query.params))
+            if query.count:
+                count = conn.execute(count_sql, query.params).fetchone()[0]
+        elif query.action == 'insert':
+            rows = query.payload if isinstance(query.payload, list) else [query.payload]
+            data = []
+            conn.execute('BEGIN')
+            try:
+                for row in rows:
+                    names = ', '.join(_ident(k) for k in row)
+                    marks = ', '.join('?' for _ in row)
+                    cursor = conn.execute(f'INSERT INTO {table} ({names}) VALUES ({marks}) RETURNING *',
+                                          [_encode(v) for v in row.values()])
+                    data.extend(self._rows(cursor))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        elif query.action == 'update':
+            touch = TOUCH_COLUMNS.get(query.table)
+            if touch and touch not in query.payload:
+                query.payload = {**query.payload, touch: 'now()'}
+            assignments = ', '.join(f'{_ident(k)} = ?' for k in query.payload)
+            cursor = conn.execute(f'UPDATE {table} SET {assignments}{query._where_sql()} RETURNING *',
+                                  [_encode(v) for v in query.payload.values()] + query.params)
+            data = self._rows(cursor)
+        elif query.action == 'delete':
+            data = self._rows(conn.execute(f'DELETE FROM {table}{query._where_sql()} RETURNING *', query.params))
+        else:
+            raise StorageError(f"Unsupported action: {query.action}")
+        if query.single_row:
+            if len(data) != 1:
+                raise StorageError(f"Expected a single row from {query.table}, got {len(data)}")
+            data = data[0]
+        return Response(data, count)
+
+    def _rpc_apply_ledger_change(self, p_user_id, p_change, p_reason, p_source,
+                                 p_meta=None, p_allow_negative=False):
+        """Same contract as sql/apply_ledger_change.sql."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'UPDATE users SET token_balance = COALESCE(token_balance, 0) + ? '
+                'WHERE id = ? AND (? OR COALESCE(token_balance, 0) + ? >= 0) RETURNING token_balance',
+                (p_change, p_user_id, bool(p_allow_negative), p_change)
+            ).fetchone()
+            if row is None:
+                conn.execute('ROLLBACK')
+                return None
+            conn.execute(
+                'INSERT INTO token_transactions (user_id, change, reason, source, meta, date_created) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (p_user_id, p_change, p_reason, p_source, _encode(p_meta), _now())
+            )
+            conn.execute('COMMIT')
+            return row[0]
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _rpc_apply_ledger_changes(self, p_updates, p_reason, p_source, p_meta=None):
+        """Same contract as sql/apply_ledger_changes.sql."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            updated, now = [], _now()
+            for update in p_updates:
+                row = conn.execute(
+                    'UPDATE users SET token_balance = ?, role = COALESCE(?, role),'
+                    ' monthly_token_quota = COALESCE(?, monthly_token_quota),'
+                    ' token_renewal_date = COALESCE(?, token_renewal_date)'
+                    ' WHERE id = ? AND deleted_at IS NULL AND token_balance IS ? RETURNING id, token_balance',
+                    (update['token_balance'], update.get('role'), update.get('monthly_token_quota'),
+                     update.get('token_renewal_date'), update['id'], update['expected_balance'])
+                ).fetchone()
+                if row is None:
+                    continue
+                updated.append({'id': row[0], 'token_balance': row[1]})
+                change = (row[1] or 0) - (update['expected_balance'] or 0)
+                if change:
+                    conn.execute(
+                        'INSERT INTO token_transactions (user_id, change, reason, source, meta, date_created) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (row[0], change, p_reason, p_source, _encode(p_meta), now)
+                    )
+            conn.execute('COMMIT')
+            return updated
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _rpc_lesson_stats(self, p_user_id, p_since):
+        """Same contract as sql/lesson_stats.sql."""
+        conn = self._conn()
+        live = 'FROM lessons WHERE user_id = ? AND deleted_at IS NULL'
+
+        def grouped(column):
+            rows = conn.execute(
+                f"SELECT COALESCE(NULLIF(CAST({column} AS TEXT), ''), 'unknown'), COUNT(*) {live} GROUP BY 1",
+                (p_user_id,)
+            ).fetchall()
+            return {key: count for key, count in rows}
+
+        presentations = conn.execute(
+            'SELECT COUNT(*) FROM presentations p JOIN lessons l ON l.id = p.lesson_id '
+            'WHERE l.user_id = ? AND l.deleted_at IS NULL', (p_user_id,)
+        ).fetchone()[0]
+        spent = conn.execute(
+            'SELECT COALESCE(-SUM(change), 0) FROM token_transactions '
+            'WHERE user_id = ? AND change < 0 AND date_created >= ?', (p_user_id, p_since)
+        ).fetchone()[0]
+        return {
+            'presentations': presentations,
+            'by_strategy': grouped('teaching_strategy'),
+            'by_grade': grouped('grade_level'),
+            'tokens_used_this_month': spent
+        }
+
+
+class _Call:
+    def __init__(self, fn, params):
+        self.fn = fn
+        self.params = params
+
+    def execute(self):
+        return Response(self.fn(**self.params))
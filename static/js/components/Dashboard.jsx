@@ -12,39 +12,28 @@ const Dashboard = ({ user }) => {
     recentActivity: []
   });
 
-  // Fetch user's lessons on component mount
+  // Fetch the dashboard summary on component mount
   useEffect(() => {
-    const fetchLessons = async () => {
+    const fetchDashboard = async () => {
       try {
         setLoading(true);
-        const response = await axios.get('/api/lessons');
-        setLessons(response.data);
-        
-        // Calculate stats
-        const totalLessons = response.data.length;
-        const totalPresentations = response.data.reduce(
-          (count, lesson) => count + lesson.presentations.length, 0
-        );
-        
-        // Get 5 most recent lessons
-        const recentActivity = [...response.data]
-          .sort((a, b) => new Date(b.date_modified) - new Date(a.date_modified))
-          .slice(0, 5);
-        
+        const response = await axios.get('/api/dashboard');
+        setLessons(response.data.recent_lessons);
         setStats({
-          totalLessons,
-          totalPresentations,
-          recentActivity
+          totalLessons: response.data.total_lessons,
+          totalPresentations: response.data.stats.presentations,
+          recentActivity: response.data.recent_lessons,
+          ...response.data.stats
         });
       } catch (err) {
         setError('Failed to load lessons. Please try again later.');
-        console.error('Error fetching lessons:', err);
+        console.error('Error fetching dashboard:', err);
       } finally {
         setLoading(false);
       }
     };
 
-    fetchLessons();
+    fetchDashboard();
   }, []);
 
   // Format date for display
@@ -16,6 +16,7 @@ const LessonForm = () => {
   const [generating, setGenerating] = useState(false);
   const [error, setError] = useState(null);
   const [lesson, setLesson] = useState(null);
+  const [preview, setPreview] = useState('');
 
   // Grade level options
   const gradeOptions = [
@@ -81,6 +82,48 @@ const LessonForm = () => {
     }));
   };
 
+  // Follow a generation job over SSE, showing the plan as it streams in;
+  // falls back to polling if the stream breaks. Resolves to the new lesson id.
+  const waitForJob = (jobId) => {
+    if (!window.EventSource) {
+      return pollJob(jobId);
+    }
+    return new Promise((resolve, reject) => {
+      const source = new EventSource(`/api/jobs/${jobId}/stream`);
+      source.onmessage = (event) => {
+        const { text } = JSON.parse(event.data);
+        setPreview(prev => prev + text);
+      };
+      source.addEventListener('done', (event) => {
+        source.close();
+        resolve(JSON.parse(event.data).result.lesson_id);
+      });
+      source.addEventListener('failed', (event) => {
+        source.close();
+        reject(new Error(JSON.parse(event.data).error || 'Lesson generation failed'));
+      });
+      source.onerror = () => {
+        source.close();
+        pollJob(jobId).then(resolve, reject);
+      };
+    });
+  };
+
+  // Poll a background generation job until it finishes; resolves to the new lesson id
+  const pollJob = async (jobId) => {
+    while (true) {
+      const response = await axios.get(`/api/jobs/${jobId}`);
+      const job = response.data.job;
+      if (job.status === 'done') {
+        return job.result.lesson_id;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Lesson generation failed');
+      }
+      await new Promise(resolve => setTimeout(resolve, 2000));
+    }
+  };
+
   // Handle form submission
   const handleSubmit = async (e) => {
     e.preventDefault();
@@ -94,6 +137,7 @@ const LessonForm = () => {
     try {
       setGenerating(true);
       setError(null);
+      setPreview('');
       
       if (isEditing) {
         // Update existing lesson
@@ -102,10 +146,11 @@ const LessonForm = () => {
       } else {
         await axios.post('/api/attendance/confirm', { amount: 1, reason: 'lesson_create' });
         const response = await axios.post('/api/lessons', formData);
-        history.push(`/lessons/${response.data.lesson.id}`);
+        const lessonId = await waitForJob(response.data.job_id);
+        history.push(`/lessons/${lessonId}`);
       }
     } catch (err) {
-      setError(err.response?.data?.message || 'An error occurred. Please try again.');
+      setError(err.response?.data?.message || err.message || 'An error occurred. Please try again.');
       console.error('Error saving lesson:', err);
     } finally {
       setGenerating(false);
@@ -224,6 +269,12 @@ const LessonForm = () => {
                 </button>
               </div>
             </form>
+
+            {generating && preview && (
+              <pre className="mt-4 p-3 bg-light border rounded" style={{ whiteSpace: 'pre-wrap', maxHeight: '400px', overflowY: 'auto' }} dir="auto">
+                {preview}
+              </pre>
+            )}
           </div>
         </div>
         
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef, useCallback } from 'react';
 import { Link } from 'react-router-dom';
 import axios from 'axios';
 
@@ -14,14 +14,23 @@ const LessonList = () => {
   const [deleteId, setDeleteId] = useState(null);
   const [showDeleteModal, setShowDeleteModal] = useState(false);
   const [deleteLoading, setDeleteLoading] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const sentinelRef = useRef(null);
 
-  // Fetch lessons on component mount
+  // The API returns one page at a time; the next page's cursor comes in a header
+  const fetchPage = async (cursor) => {
+    const response = await axios.get('/api/lessons', { params: cursor ? { cursor } : {} });
+    setNextCursor(response.headers['x-next-cursor'] || null);
+    return response.data;
+  };
+
+  // Fetch the first page on component mount
   useEffect(() => {
     const fetchLessons = async () => {
       try {
         setLoading(true);
-        const response = await axios.get('/api/lessons');
-        setLessons(response.data);
+        setLessons(await fetchPage());
       } catch (err) {
         setError('Failed to load lessons. Please try again later.');
         console.error('Error fetching lessons:', err);
@@ -33,6 +42,51 @@ const LessonList = () => {
     fetchLessons();
   }, []);
 
+  // Append the next page
+  const loadMore = useCallback(async () => {
+    if (!nextCursor || loadingMore) return;
+    try {
+      setLoadingMore(true);
+      const page = await fetchPage(nextCursor);
+      setLessons(prev => [...prev, ...page]);
+    } catch (err) {
+      setError('Failed to load more lessons. Please try again later.');
+      console.error('Error fetching lessons:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [nextCursor, loadingMore]);
+
+  // Infinite scroll: load the next page when the sentinel below the table comes into view
+  useEffect(() => {
+    const sentinel = sentinelRef.current;
+    if (!sentinel || !nextCursor) return undefined;
+    const observer = new IntersectionObserver(entries => {
+      if (entries.some(entry => entry.isIntersecting)) loadMore();
+    }, { rootMargin: '400px' });
+    observer.observe(sentinel);
+    return () => observer.disconnect();
+  }, [nextCursor, loadMore, loading]);
+
+  // Server-side full-text search, debounced; null means "not searching"
+  const [searchResults, setSearchResults] = useState(null);
+  useEffect(() => {
+    const query = searchTerm.trim();
+    if (!query) {
+      setSearchResults(null);
+      return undefined;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axios.get('/api/lessons/search', { params: { q: query } });
+        setSearchResults(response.data.results);
+      } catch (err) {
+        console.error('Error searching lessons:', err);
+      }
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
+
   // Handle search input change
   const handleSearchChange = (e) => {
     setSearchTerm(e.target.value);
@@ -47,10 +101,10 @@ const LessonList = () => {
     }));
   };
 
-  // Filter and search lessons
-  const filteredLessons = lessons.filter(lesson => {
-    // Apply search term filter
-    const matchesSearch = lesson.topic.toLowerCase().includes(searchTerm.toLowerCase());
+  // Filter search results, or the loaded pages when not searching
+  const filteredLessons = (searchResults || lessons).filter(lesson => {
+    // Topic-only match while the server search is in flight
+    const matchesSearch = searchResults || lesson.topic.toLowerCase().includes(searchTerm.toLowerCase());
     
     // Apply grade level filter if selected
     const matchesGrade = filter.gradeLevel ? lesson.grade_level === filter.gradeLevel : true;
@@ -63,6 +117,7 @@ const LessonList = () => {
 
   // Format date for display
   const formatDate = (dateString) => {
+    if (!dateString) return '';
     const options = { year: 'numeric', month: 'short', day: 'numeric' };
     return new Date(dateString).toLocaleDateString(undefined, options);
   };
@@ -183,6 +238,10 @@ const LessonList = () => {
                   <Link to={`/lessons/${lesson.id}`} className="text-decoration-none">
                     {lesson.topic}
                   </Link>
+                  {lesson.snippet && (
+                    // The server escapes the text and only adds <mark> tags
+                    <div className="small text-muted" dangerouslySetInnerHTML={{ __html: lesson.snippet }} />
+                  )}
                 </td>
                 <td>{lesson.grade_level}</td>
                 <td>
@@ -282,6 +341,17 @@ const LessonList = () => {
       <div className="card shadow-sm">
         <div className="card-body">
           {content}
+          {!loading && !error && !searchResults && nextCursor && (
+            <div ref={sentinelRef} className="text-center py-3">
+              <button
+                className="btn btn-outline-primary btn-sm"
+                onClick={loadMore}
+                disabled={loadingMore}
+              >
+                {loadingMore ? 'Loading...' : 'Load more'}
+              </button>
+            </div>
+          )}
         </div>
       </div>
       
@@ -14,6 +14,8 @@ const LessonView = () => {
   const [generationSuccess, setGenerationSuccess] = useState(null);
   const [isEditing, setIsEditing] = useState(false);
   const [editedContent, setEditedContent] = useState('');
+  // ETag of the loaded version; sent back as If-Match when saving
+  const [etag, setEtag] = useState(null);
 
   // Fetch lesson data
   useEffect(() => {
@@ -22,6 +24,7 @@ const LessonView = () => {
         setLoading(true);
         const response = await axios.get(`/api/lessons/${id}`);
         setLesson(response.data);
+        setEtag(response.headers.etag || null);
         setEditedContent(response.data.generated_plan || '');
       } catch (err) {
         setError('Failed to load lesson. Please try again later.');
@@ -51,6 +54,7 @@ const LessonView = () => {
         // Refresh lesson data to include new presentation
         const lessonResponse = await axios.get(`/api/lessons/${id}`);
         setLesson(lessonResponse.data);
+        setEtag(lessonResponse.headers.etag || null);
       }
     } catch (err) {
       setError('Failed to generate presentation. Please try again later.');
@@ -92,15 +96,18 @@ const LessonView = () => {
   // Save edited content
   const saveEditedContent = async () => {
     try {
-      await axios.put(`/api/lessons/${id}`, {
-        generated_plan: editedContent
-      });
+      // Only saved if nobody changed the lesson since it was loaded. Prefer the
+      // server's ETag; without any version, save without the precondition.
+      const ifMatch = etag || (lesson.date_modified ? `"${lesson.date_modified}"` : null);
+      const response = ifMatch
+        ? await axios.patch(`/api/lessons/${id}`, { generated_plan: editedContent }, {
+            headers: { 'If-Match': ifMatch }
+          })
+        : await axios.put(`/api/lessons/${id}`, { generated_plan: editedContent });
       
-      // Update lesson state with edited content
-      setLesson(prev => ({
-        ...prev,
-        generated_plan: editedContent
-      }));
+      // Update lesson state with the saved lesson and its new version
+      setLesson(response.data.lesson);
+      setEtag(response.headers.etag || null);
       
       // Exit edit mode
       setIsEditing(false);
@@ -108,7 +115,11 @@ const LessonView = () => {
         message: 'Lesson plan updated successfully.'
       });
     } catch (err) {
-      setError('Failed to save changes. Please try again later.');
+      if (err.response && err.response.status === 412) {
+        setError('This lesson was changed elsewhere. Copy your edits and reload the page before saving.');
+      } else {
+        setError('Failed to save changes. Please try again later.');
+      }
       console.error('Error saving changes:', err);
     }
   };
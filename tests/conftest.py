@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app configures itself from the environment at import time: use the
+# embedded SQLite store and the stub LLM so no credentials are needed.
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "test.sqlite3"))
+os.environ.setdefault("LLM_PROVIDER", "stub")
+os.environ.setdefault("SESSION_SECRET", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    return flask_app
+
+
+@pytest.fixture
+def db(app):
+    return app.config["SUPABASE_CLIENT"]
+
+
+@pytest.fixture
+def make_user(db):
+    created = []
+
+    def make(role='teacher', token_balance=100):
+        n = len(created)
+        row = db.table('users').insert({
+            'name': f'user{n}', 'email': f'user{n}-{os.urandom(4).hex()}@example.com', 'role': role,
+            'token_balance': token_balance, 'monthly_token_quota': 100
+        }).execute().data[0]
+        created.append(row['id'])
+        return row
+
+    yield make
+    if created:
+        db.table('users').delete().in_('id', created).execute()
+
+
+@pytest.fixture
+def admin_client(app, make_user):
+    admin = make_user(role='admin')
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin['id'])
+        session['_fresh'] = True
+    return client
@@ -0,0 +1,24 @@
+def balances(db, ids):
+    rows = db.table('users').select('id,token_balance').in_('id', ids).execute().data
+    return {row['id']: row['token_balance'] for row in rows}
+
+
+def test_filter_max_balance_zero_only_targets_empty_balances(admin_client, db, make_user):
+    empty = make_user(role='bulktest', token_balance=0)
+    funded = make_user(role='bulktest', token_balance=50)
+    r = admin_client.post('/api/admin/users/bulk', json={
+        'action': 'adjust_tokens', 'adjust': 5, 'filter': {'role': 'bulktest', 'max_balance': 0}
+    })
+    assert r.status_code == 200, r.get_json()
+    assert r.get_json()['summary'] == {'updated': 1}
+    assert balances(db, [empty['id'], funded['id']]) == {empty['id']: 5, funded['id']: 50}
+
+
+def test_filter_max_balance_must_be_an_integer(admin_client, db, make_user):
+    user = make_user(role='bulktest', token_balance=50)
+    for bad in ('zero', 1.5, True, {}):
+        r = admin_client.post('/api/admin/users/bulk', json={
+            'action': 'reset_balance', 'filter': {'role': 'bulktest', 'max_balance': bad}
+        })
+        assert r.status_code == 400
+    assert balances(db, [user['id']]) == {user['id']: 50}
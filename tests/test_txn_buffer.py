@@ -0,0 +1,44 @@
+import json
+import threading
+import time
+
+from flask import Flask
+
+from sqlite_store import SQLiteClient
+from txn_buffer import TransactionBuffer
+
+
+def test_spill_is_replayed_while_the_queue_stays_busy(tmp_path):
+    db = SQLiteClient(str(tmp_path / 'db.sqlite3'))
+    user_id = db.table('users').insert({'email': 'spender@example.com'}).execute().data[0]['id']
+    spill_path = tmp_path / 'spill.jsonl'
+    spill_path.write_text(''.join(
+        json.dumps({'user_id': user_id, 'change': -1, 'reason': 'spilled', 'source': 'app'}) + '\n'
+        for _ in range(3)
+    ))
+    # The writer waits up to a second for a row, far longer than the feeder's gaps,
+    # so the idle path never runs and only the timed replay can pick up the spill
+    app = Flask(__name__)
+    app.config.update(SUPABASE_CLIENT=db, TXN_BUFFER_FLUSH_MS=1000, TXN_BUFFER_BATCH_SIZE=10,
+                      TXN_BUFFER_REPLAY_INTERVAL=0.1, TXN_BUFFER_SPILL_PATH=str(spill_path))
+    buffer = TransactionBuffer(app)
+    stop = threading.Event()
+
+    def spend():
+        while not stop.is_set():
+            buffer.put({'user_id': user_id, 'change': -1, 'reason': 'live', 'source': 'app'})
+            time.sleep(0.002)
+
+    feeder = threading.Thread(target=spend, daemon=True)
+    feeder.start()
+    try:
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and spill_path.exists():
+            time.sleep(0.02)
+        assert not spill_path.exists()
+    finally:
+        stop.set()
+        feeder.join()
+        buffer.close()
+    spilled = db.table('token_transactions').select('id').eq('reason', 'spilled').execute().data
+    assert len(spilled) == 3
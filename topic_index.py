@@ -0,0 +1,141 @@
+import logging
+import math
+import re
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+TATWEEL = '\u0640'
+ARABIC_FOLDS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+    'ة': 'ه',
+})
+NON_WORD = re.compile(r'[^\w\s]')
+
+
+def normalize_topic(text):
+    """Fold a topic so spelling variants of the same unit compare equal.
+
+    Strips Arabic diacritics and tatweel, folds alef/ya/ta-marbuta variants,
+    lowercases Latin text and collapses punctuation and whitespace.
+    """
+    text = unicodedata.normalize('NFKC', str(text or ''))
+    text = ARABIC_DIACRITICS.sub('', text).replace(TATWEEL, '')
+    text = text.translate(ARABIC_FOLDS).casefold()
+    text = NON_WORD.sub(' ', text)
+    return ' '.join(text.split())
+
+
+def topic_grams(text, n=3):
+    """Character n-grams of the normalized topic, padded so short words still count."""
+    padded = f" {normalize_topic(text)} "
+    if len(padded) <= n:
+        return frozenset([padded])
+    return frozenset(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+class TopicIndex:
+    """In-memory character-trigram index over previously generated lessons.
+
+    Lessons are bucketed by (grade, strategy, language) so only comparable
+    plans are matched. Lookups use prefix filtering: only the rarest query
+    grams are probed in the posting lists, and candidates are then verified
+    with exact Jaccard similarity, which keeps lookups well under a
+    millisecond even with very common grams such as "ال".
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._postings = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    @staticmethod
+    def bucket(grade_level, teaching_strategy, language):
+        return (str(grade_level or '').strip().casefold(),
+                str(teaching_strategy or '').strip().casefold(),
+                str(language or '').strip().casefold())
+
+    def add(self, lesson_id, topic, grade_level, teaching_strategy, language):
+        bucket = self.bucket(grade_level, teaching_strategy, language)
+        grams = topic_grams(topic)
+        with self._lock:
+            self._remove_locked(lesson_id)
+            self._entries[lesson_id] = (bucket, grams)
+            postings = self._postings.setdefault(bucket, {})
+            for gram in grams:
+                postings.setdefault(gram, set()).add(lesson_id)
+
+    def remove(self, lesson_id):
+        with self._lock:
+            self._remove_locked(lesson_id)
+
+    def _remove_locked(self, lesson_id):
+        entry = self._entries.pop(lesson_id, None)
+        if not entry:
+            return
+        bucket, grams = entry
+        postings = self._postings.get(bucket, {})
+        for gram in grams:
+            ids = postings.get(gram)
+            if ids is not None:
+                ids.discard(lesson_id)
+                if not ids:
+                    del postings[gram]
+
+    def find_similar(self, topic, grade_level, teaching_strategy, language, threshold=0.85, limit=5):
+        """Return ``[(lesson_id, score), ...]`` with Jaccard score >= threshold, best first."""
+        bucket = self.bucket(grade_level, teaching_strategy, language)
+        grams = topic_grams(topic)
+        with self._lock:
+            postings = self._postings.get(bucket)
+            if not postings:
+                return []
+            # Any match must share at least one of the (|q| - ceil(t*|q|) + 1) rarest grams
+            ordered = sorted(grams, key=lambda g: len(postings.get(g, ())))
+            prefix = len(grams) - math.ceil(threshold * len(grams)) + 1
+            candidates = set()
+            for gram in ordered[:prefix]:
+                candidates.update(postings.get(gram, ()))
+            results = []
+            for lesson_id in candidates:
+                other = self._entries[lesson_id][1]
+                overlap = len(grams & other)
+                score = overlap / (len(grams) + len(other) - overlap)
+                if score >= threshold:
+                    results.append((lesson_id, score))
+        results.sort(key=lambda r: (-r[1], r[0]))
+        return results[:limit]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, supabase, page_size=1000):
+        """Build the index from the reusable, live lessons of live accounts, fetching only the small columns."""
+        start = 0
+        while True:
+            r = (supabase.table('lessons')
+                 .select('id,topic,grade_level,teaching_strategy,language,users!inner(deleted_at)')
+                 .neq('generated_plan', '')
+                 .eq('reusable', True)
+                 .is_('deleted_at', 'null')
+                 .is_('users.deleted_at', 'null')
+                 .order('id')
+                 .range(start, start + page_size - 1)
+                 .execute())
+            rows = r.data or []
+            for row in rows:
+                self.add(row['id'], row.get('topic'), row.get('grade_level'),
+                         row.get('teaching_strategy'), row.get('language'))
+            if len(rows) < page_size:
+                break
+            start += page_size
+        self.loaded = True
+        logger.info(f"Topic index loaded with {len(self)} lessons")
+
+
+topic_index = TopicIndex()
@@ -0,0 +1,55 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, len(self._data)
+        total = hits + misses
+        return {
+            'entries': size,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0
+        }
@@ -0,0 +1,218 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; each process then spills to its own file
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionBuffer:
+    """Write-behind buffer for token_transactions rows.
+
+    Rows are queued by the request thread and a background thread inserts
+    them in multi-row batches every ``flush_interval`` seconds or as soon
+    as ``batch_size`` rows are waiting. The queue is bounded: when it is
+    full, ``put`` blocks for up to ``put_timeout`` and then falls back to a
+    synchronous insert. Batches that cannot be inserted are appended to a
+    JSON-lines spill file and replayed when the writer is idle, or after a
+    successful flush at most every ``replay_interval`` seconds while it is
+    busy. Pending rows are flushed at interpreter exit.
+
+    Worker processes share the spill file: appends and replays are
+    serialized with ``flock``. A replay moves the file aside, inserts its
+    rows and only then removes it, so rows survive a crash mid-replay
+    (they may then be inserted twice, never lost).
+    """
+
+    def __init__(self, app=None):
+        self.supabase = None
+        self.batch_size = 200
+        self.flush_interval = 0.5
+        self.put_timeout = 1.0
+        self.spill_path = None
+        self.replay_backoff = 30.0
+        self.replay_interval = 5.0
+        self._next_replay = 0.0
+        self._replay_due = 0.0
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._spill_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.supabase = app.config["SUPABASE_CLIENT"]
+        self.batch_size = int(app.config.get('TXN_BUFFER_BATCH_SIZE', 200))
+        self.flush_interval = float(app.config.get('TXN_BUFFER_FLUSH_MS', 500)) / 1000
+        self.spill_path = app.config.get('TXN_BUFFER_SPILL_PATH', 'token_transactions.spill.jsonl')
+        self.replay_interval = float(app.config.get('TXN_BUFFER_REPLAY_INTERVAL', 5))
+        if fcntl is None:
+            self.spill_path = f"{self.spill_path}.{os.getpid()}"
+        self._queue = queue.Queue(maxsize=int(app.config.get('TXN_BUFFER_MAX_ROWS', 10000)))
+        self._thread = threading.Thread(target=self._run, name='txn-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        app.extensions['txn_buffer'] = self
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def put(self, row):
+        try:
+            self._queue.put(row, timeout=self.put_timeout)
+        except queue.Full:
+            logger.warning("Token transaction buffer full; writing synchronously")
+            self._insert([row])
+
+    def _drain(self, first=None):
+        rows = [] if first is None else [first]
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._run_once()
+            except Exception:
+                # A dead writer thread would let the queue fill up silently; log and keep going
+                logger.exception("Token transaction buffer iteration failed")
+                time.sleep(self.flush_interval)
+        self.flush()
+
+    def _run_once(self):
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            self._replay_spill()
+            return
+        deadline = time.monotonic() + self.flush_interval
+        rows = self._drain(first)
+        while len(rows) < self.batch_size and time.monotonic() < deadline and not self._stop.is_set():
+            time.sleep(min(0.05, max(0.0, deadline - time.monotonic())))
+            rows.extend(self._drain())
+        # Under steady traffic the queue is never empty, so replay on a timer too
+        if self._insert(rows) and time.monotonic() >= self._replay_due:
+            self._replay_due = time.monotonic() + self.replay_interval
+            self._replay_spill()
+
+    def flush(self):
+        """Synchronously write everything still queued."""
+        if self._queue is None:
+            return
+        while True:
+            rows = self._drain()
+            if not rows:
+                break
+            self._insert(rows)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=10)
+        if self._queue is not None:
+            self.flush()
+
+    def _insert(self, rows, spill=True):
+        try:
+            self.supabase.table('token_transactions').insert(rows).execute()
+            return True
+        except Exception as e:
+            if not spill:
+                logger.error(f"Token transaction insert failed ({len(rows)} rows): {e}")
+                return False
+            logger.error(f"Token transaction insert failed, spilling {len(rows)} rows: {e}")
+            self._spill(rows)
+            return False
+
+    @staticmethod
+    def _lock_exclusive(f):
+        """Lock an open file against other processes until it is closed."""
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _spill(self, rows):
+        with self._spill_lock:
+            while True:
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    self._lock_exclusive(f)
+                    # A replay in another process may have moved the file while we waited for the lock
+                    try:
+                        moved = os.fstat(f.fileno()).st_ino != os.stat(self.spill_path).st_ino
+                    except FileNotFoundError:
+                        moved = True
+                    if moved:
+                        continue
+                    for row in rows:
+                        f.write(json.dumps(row, ensure_ascii=False) + '\n')
+                    f.flush()
+                    return
+
+    def _replay_spill(self):
+        if not self.spill_path or time.monotonic() < self._next_replay:
+            return
+        replay_path = f"{self.spill_path}.replay"
+        if not os.path.exists(self.spill_path) and not os.path.exists(replay_path):
+            return
+        with self._spill_lock, open(f"{self.spill_path}.lock", 'a') as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return  # another process is replaying
+            # A replay file left by a crashed replay is finished before new spills are taken
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    self._lock_exclusive(f)
+                    os.replace(self.spill_path, replay_path)
+            rows = self._read_spill(replay_path)
+            for i in range(0, len(rows), self.batch_size):
+                if not self._insert(rows[i:i + self.batch_size], spill=False):
+                    # Keep what is left for the next attempt
+                    self._write_spill(replay_path, rows[i:])
+                    self._next_replay = time.monotonic() + self.replay_backoff
+                    return
+                if i + self.batch_size < len(rows):
+                    self._write_spill(replay_path, rows[i + self.batch_size:])
+            os.remove(replay_path)
+        if rows:
+            logger.info(f"Replayed spilled token transactions ({len(rows)} rows)")
+
+    @staticmethod
+    def _read_spill(path):
+        rows = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    logger.error(f"Skipping unreadable spilled token transaction: {line[:200]!r}")
+        return rows
+
+    @staticmethod
+    def _write_spill(path, rows):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+
+
+transaction_buffer = TransactionBuffer()